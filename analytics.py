@@ -0,0 +1,81 @@
+from fastapi import APIRouter,Depends,HTTPException,Query,Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_read_db
+import main,curd,columnar,fastjson,metrics,sketches,config
+from typing import List, Optional
+from datetime import date
+from pydantic import BaseModel
+
+router = APIRouter(prefix="/analytics",tags=["Analytics"],route_class=metrics.TimedRoute)
+
+# Columns a time series can be split by
+SPLIT_COLUMNS = {
+    "category": main.Product.category,
+    "status": main.Product.status,
+    "payment_method": main.Product.payment_method,
+}
+
+
+TIMESERIES_ARROW_TYPES = {
+    "bucket": columnar.pa.date32(),
+    "series": columnar.pa.string(),
+    "total_sales": columnar.pa.int64(),
+    "quantity": columnar.pa.int64(),
+    "orders": columnar.pa.int64(),
+    "avg_price": columnar.pa.float64(),
+} if columnar.pa else {}
+
+
+class RevenueBucket(BaseModel):
+    bucket: date
+    series: Optional[str] = None
+    total_sales: int
+    quantity: int
+    orders: int
+    avg_price: Optional[float] = None
+
+
+class KpiSummary(BaseModel):
+    orders: int
+    total_sales: int
+    avg_price: Optional[float] = None
+    unique_customers: int
+    # Set when unique_customers is a HyperLogLog estimate: about 95% of estimates are within this many
+    unique_customers_error: Optional[int] = None
+
+
+@router.get("/summary",response_model=KpiSummary)
+async def kpi_summary(exact:bool=False,db:AsyncSession=Depends(get_read_db)):
+    """Order count, total sales, average price and distinct customers, in one aggregate query.
+
+    With SKETCHES_ENABLED the distinct count comes from the customer HyperLogLog unless exact=true.
+    """
+    estimate = await sketches.unique_customers(db) if config.SKETCHES_ENABLED and not exact else None
+    result = await db.execute(curd.kpi_summary_query(unique_customers=estimate is None))
+    summary = dict(result.one()._mapping)
+    if estimate:
+        summary["unique_customers"] = estimate[0]["unique_customers"]
+        summary["unique_customers_error"] = estimate[0]["error_bound"]
+    return summary
+
+
+@router.get("/timeseries",response_model=List[RevenueBucket],response_model_exclude_unset=True)
+async def revenue_timeseries(request:Request,granularity:str=Query("day",pattern="^(day|week|month)$"),
+                             split_by:Optional[str]=Query(None,pattern="^(category|status|payment_method)$"),
+                             from_date:Optional[date]=None,to_date:Optional[date]=None,
+                             db:AsyncSession=Depends(get_read_db)):
+    """Sales, volume, order count and average price per day / week / month, computed in the database."""
+    if from_date and to_date and from_date > to_date:
+        raise HTTPException(status_code=400, detail="from_date is after to_date")
+    conn = await db.connection()
+    split_column = SPLIT_COLUMNS[split_by] if split_by else None
+    query = curd.revenue_timeseries_query(granularity, conn.dialect.name, split_column, from_date, to_date)
+    result = await db.execute(query)
+    media_type = columnar.negotiate(request)
+    if media_type:
+        names = list(result.keys())
+        return columnar.rows_response(result.all(), names, {name: TIMESERIES_ARROW_TYPES[name] for name in names},
+                                      media_type)
+    if fastjson.enabled():
+        return fastjson.rows_response(result.all(), list(result.keys()))
+    return [dict(row._mapping) for row in result]
@@ -1,8 +1,12 @@
 import streamlit as st
-import requests
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import pandas as pd
+import threading
+import time
 from datetime import date
 
+from dashboard_client import DEFAULT_TIMEOUT, ApiError, DashboardClient, fetch_concurrently
+
 # =========================
 # BASIC CONFIG
 # =========================
@@ -28,26 +32,40 @@ BASE_URL = st.sidebar.text_input(
 # =========================
 # HELPER: API REQUEST WRAPPER
 # =========================
-def handle_request(method: str, endpoint: str, base_url: str, **kwargs):
-    """Generic request wrapper with basic error handling."""
-    url = f"{base_url}{endpoint}"
-    try:
-        resp = requests.request(method=method, url=url, timeout=15, **kwargs)
-    except Exception as e:
-        st.error(f"Request failed: {e}")
-        return None
+@st.cache_resource(show_spinner=False)
+def get_client(base_url: str) -> DashboardClient:
+    # One pooled keep-alive session per backend, shared across reruns
+    return DashboardClient(base_url)
 
-    if not resp.ok:
-        st.error(f"API error [{resp.status_code}]: {resp.text}")
-        return None
 
+def handle_request(method: str, endpoint: str, base_url: str, timeout=DEFAULT_TIMEOUT,
+                   as_frame: bool = False, **kwargs):
+    """Generic request wrapper with basic error handling.
+
+    With as_frame=True the result is a DataFrame, fetched as an Arrow stream when possible.
+    """
     try:
-        return resp.json()
-    except ValueError:
-        st.error("Failed to parse JSON response.")
+        return get_client(base_url).request(method, endpoint, timeout=timeout, as_frame=as_frame, **kwargs)
+    except ApiError as e:
+        st.error(str(e))
         return None
 
 
+def run_concurrently(**calls):
+    """Run a view's independent API calls in parallel; returns {name: result}."""
+    ctx = get_script_run_ctx()
+
+    def attach_context():
+        # Lets the worker threads use st.cache_data and report errors with st.error
+        add_script_run_ctx(threading.current_thread(), ctx)
+
+    return fetch_concurrently(calls, initializer=attach_context)
+
+
+def has_rows(data) -> bool:
+    return data is not None and len(data) > 0
+
+
 # =========================
 # BACKEND HEALTH CHECK
 # =========================
@@ -69,17 +87,95 @@ else:
 # =========================
 # API CALL HELPERS
 # =========================
-@st.cache_data(show_spinner=False)
-def get_all_products(base_url: str):
-    return handle_request("GET", "/products/", base_url)
-
-
-def search_products_by_name(keyword: str, base_url: str):
-    return handle_request("GET", f"/products/search/{keyword}", base_url)
-
-
-def filter_products_by_category(word: str, base_url: str):
-    return handle_request("GET", f"/products/filter/{word}", base_url)
+# Seconds between checks of /products/version for the locally kept product table
+PRODUCTS_SYNC_TTL = 60
+# Seconds a cached API response (KPIs, rankings, time series) is reused, so data loaded by another
+# client or process shows up without a manual refresh
+API_CACHE_TTL = 60
+
+
+def get_product_changes(base_url: str, since=None, page_size: int = 5000):
+    # /products/changes is keyset-paginated over (loaded_at, id); follow next_cursor until the last page
+    pages = []
+    params = {"limit": page_size}
+    if since is not None:
+        params["since"] = since.isoformat()
+    while True:
+        page = handle_request("GET", "/products/changes", base_url, as_frame=True, params=params)
+        if page is None:
+            return None
+        pages.append(page)
+        cursor = page.attrs.get("next_cursor")
+        if not cursor:
+            break
+        params = {"limit": page_size, "cursor": cursor}
+    return pd.concat(pages, ignore_index=True) if len(pages) > 1 else pages[0]
+
+
+def get_all_products(base_url: str, force: bool = False):
+    """All products, kept in session_state and refreshed with only the rows loaded since the last sync."""
+    state = st.session_state
+    if state.get("products_base_url") != base_url:
+        for key in ("products", "products_version", "products_checked_at"):
+            state.pop(key, None)
+        state["products_base_url"] = base_url
+
+    products = state.get("products")
+    checked_at = state.get("products_checked_at")
+    if products is not None and not force and checked_at and time.time() - checked_at < PRODUCTS_SYNC_TTL:
+        return products
+
+    info = handle_request("GET", "/products/version", base_url)
+    if info is None:
+        return products
+    version = pd.Timestamp(info["version"]) if info["version"] else None
+    if products is not None and version == state.get("products_version"):
+        state["products_checked_at"] = time.time()
+        return products
+
+    known = state.get("products_version") if products is not None else None
+    # The server only hands out rows no later commit can precede, so resuming at the version is exact
+    changes = get_product_changes(base_url, since=known)
+    if changes is None:
+        return products
+    if known is not None:
+        # Changed rows replace their previous version
+        changes = pd.concat([products, changes], ignore_index=True).drop_duplicates("id", keep="last",
+                                                                                    ignore_index=True)
+    state["products"] = changes
+    state["products_version"] = version
+    state["products_checked_at"] = time.time()
+    return changes
+
+
+@st.cache_data(ttl=API_CACHE_TTL, show_spinner=False)
+def get_kpi_summary(base_url: str):
+    # Overview KPIs computed by the backend in one aggregate query
+    return handle_request("GET", "/analytics/summary", base_url)
+
+
+@st.cache_data(ttl=API_CACHE_TTL, show_spinner=False)
+def get_recent_orders(base_url: str, limit: int = 50):
+    return handle_request("GET", "/products/recent", base_url, as_frame=True, params={"limit": limit})
+
+
+def query_products(base_url: str, params: dict):
+    # One filtered, sorted page from /products/query; the JSON envelope carries total and next_offset
+    resp = handle_request("GET", "/products/query", base_url, params=params)
+    if resp is None:
+        return None, None
+    return pd.DataFrame(resp["items"]), resp.get("total")
+
+
+def search_products_by_name(keyword: str, base_url: str, limit: int = 500):
+    # Results are ranked by the backend, best matches first
+    return handle_request("GET", f"/products/search/{keyword}", base_url, as_frame=True,
+                          params={"limit": limit})
+
+
+def filter_products_by_category(word: str, base_url: str, limit: int = 500):
+    return handle_request("GET", f"/products/filter/{word}", base_url, as_frame=True,
+                          params={"limit": limit})
 
 
 def filter_products_by_date_range(from_dt: date, to_dt: date, base_url: str):
@@ -88,6 +184,7 @@ def filter_products_by_date_range(from_dt: date, to_dt: date, base_url: str):
         "GET",
         f"/products/filter/{from_dt.isoformat()}/{to_dt.isoformat()}",
         base_url,
+        as_frame=True,
     )
 
 
@@ -97,21 +194,92 @@ def filter_products_by_price(min_price: float, max_price: float, base_url: str):
         "GET",
         f"/products/filter/price/{max_price}/{min_price}",
         base_url,
+        as_frame=True,
     )
 
 
-@st.cache_data(show_spinner=False)
-def get_customers_by_location(base_url: str):
-    return handle_request("GET", "/customer/user", base_url)
+# Customer ranking metric -> column holding it in the /customer responses
+CUSTOMER_METRIC_COLUMNS = {"orders": None, "total_sales": "total_sales", "quantity": "total_quantity"}
+
+
+@st.cache_data(ttl=API_CACHE_TTL, show_spinner=False)
+def get_customers_by_location(base_url: str, metric: str = "orders", limit: int = 20):
+    return handle_request("GET", "/customer/user", base_url, params={"metric": metric, "limit": limit})
+
+
+@st.cache_data(ttl=API_CACHE_TTL, show_spinner=False)
+def get_top_customers_by_orders(base_url: str, metric: str = "orders", limit: int = 20):
+    # Only the top N: the backend ranks and limits in SQL instead of returning every customer
+    return handle_request("GET", "/customer/mostorder", base_url, params={"metric": metric, "limit": limit})
 
 
-@st.cache_data(show_spinner=False)
-def get_top_customers_by_orders(base_url: str):
-    return handle_request("GET", "/customer/mostorder", base_url)
+@st.cache_data(ttl=API_CACHE_TTL, show_spinner=False)
+def get_revenue_timeseries(base_url: str, granularity: str, split_by, from_dt: date, to_dt: date):
+    params = {
+        "granularity": granularity,
+        "from_date": from_dt.isoformat(),
+        "to_date": to_dt.isoformat(),
+    }
+    if split_by:
+        params["split_by"] = split_by
+    return handle_request("GET", "/analytics/timeseries", base_url, as_frame=True, params=params)
 
 
-def trigger_load_products(base_url: str):
-    return handle_request("POST", "/load-products", base_url)
+def start_server_csv_job(base_url: str, mode: str = "full"):
+    return handle_request("POST", "/ingest/server-csv", base_url, params={"mode": mode})
+
+
+def upload_csv_file(uploaded_file, base_url: str, mode: str = "full", source: str = None):
+    # Large files take a while to send; the insert itself runs as a background job
+    params = {"mode": mode}
+    if source:
+        params["source"] = source
+    return handle_request(
+        "POST",
+        "/ingest/upload",
+        base_url,
+        timeout=600,
+        params=params,
+        files={"file": (uploaded_file.name, uploaded_file, "text/csv")},
+    )
+
+
+def get_ingest_job(job_id: str, base_url: str):
+    return handle_request("GET", f"/ingest/jobs/{job_id}", base_url)
+
+
+def poll_ingest_job(job_id: str, base_url: str, interval: float = 1.0):
+    """Poll a background ingest job, updating a progress bar until it finishes."""
+    progress = st.progress(0.0)
+    status_line = st.empty()
+    while True:
+        job = get_ingest_job(job_id, base_url)
+        if job is None:
+            return None
+        progress.progress(min(float(job["progress"]), 1.0))
+        status_line.write(
+            f"**{job['status']}** – {job['rows_loaded']} rows loaded, "
+            f"{job['rows_skipped']} skipped, {job['rows_failed']} failed, "
+            f"{job['rows_per_second'] or 0} rows/s"
+        )
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(interval)
+
+
+def show_job_result(job):
+    if job is None:
+        st.error("Lost track of the ingest job. Check logs / backend.")
+    elif job["status"] == "completed":
+        st.cache_data.clear()
+        # Next read of the product table checks /products/version again
+        st.session_state.pop("products_checked_at", None)
+        st.success(f"Loaded {job['rows_loaded']} rows.")
+    else:
+        st.error("Ingest job failed.")
+    if job and job["errors"]:
+        st.write("Errors:")
+        st.write(job["errors"])
 
 
 # =========================
@@ -124,6 +292,7 @@ page = st.sidebar.radio(
         "Overview",
         "Products: Browse & Filter",
         "Customer Analytics",
+        "Sales Trends",
         "Admin: Load CSV to DB",
     ],
 )
@@ -134,70 +303,40 @@ page = st.sidebar.radio(
 if page == "Overview":
     st.subheader("Overview")
 
-    products = get_all_products(BASE_URL)
+    results = run_concurrently(
+        summary=lambda: get_kpi_summary(BASE_URL),
+        recent=lambda: get_recent_orders(BASE_URL, limit=50),
+    )
+    summary = results["summary"]
 
-    if not products:
+    if not summary or not summary.get("orders"):
         st.info("No products returned. Make sure the API is running and the DB has data.")
     else:
-        df = pd.DataFrame(products)
-
-        required_cols = {
-            "id",
-            "date",
-            "name",
-            "category",
-            "price",
-            "quantity",
-            "total_sales",
-            "customer_name",
-            "customer_location",
-            "payment_method",
-            "status",
-        }
-        missing = required_cols - set(df.columns)
-        if missing:
-            st.warning(f"Missing columns in response: {missing}")
-
-        # Convert date column to datetime if present
-        if "date" in df.columns:
-            df["date"] = pd.to_datetime(df["date"])
-
         # KPI cards
         col1, col2, col3, col4 = st.columns(4)
 
         with col1:
-            st.metric("Total Orders", len(df))
+            st.metric("Total Orders", summary["orders"])
 
         with col2:
-            if "total_sales" in df.columns:
-                st.metric(
-                    "Total Sales (sum of total_sales)",
-                    int(df["total_sales"].sum()),
-                )
-            else:
-                st.metric("Total Sales", "N/A")
+            st.metric("Total Sales (sum of total_sales)", int(summary["total_sales"]))
 
         with col3:
-            if "price" in df.columns:
-                st.metric(
-                    "Average Price",
-                    round(float(df["price"].mean()), 2),
-                )
-            else:
-                st.metric("Average Price", "N/A")
+            avg_price = summary.get("avg_price")
+            st.metric("Average Price", round(float(avg_price), 2) if avg_price is not None else "N/A")
 
         with col4:
-            if "customer_name" in df.columns:
-                st.metric("Unique Customers", df["customer_name"].nunique())
-            else:
-                st.metric("Unique Customers", "N/A")
+            error = summary.get("unique_customers_error")
+            # Estimated from the server's HyperLogLog sketch when it reports an error bound
+            st.metric("Unique Customers", summary["unique_customers"],
+                      help=f"Estimate, ±{error} (95%)" if error is not None else None)
 
         st.markdown("### Recent Orders")
-        if "date" in df.columns:
-            df_sorted = df.sort_values("date", ascending=False)
+        recent = results["recent"]
+        if has_rows(recent):
+            st.dataframe(recent, use_container_width=True)
         else:
-            df_sorted = df
-        st.dataframe(df_sorted.head(50), use_container_width=True)
+            st.info("No recent orders.")
 
 
 # =========================
@@ -206,20 +345,67 @@ if page == "Overview":
 elif page == "Products: Browse & Filter":
     st.subheader("Products – Browse & Filter")
 
-    tab_all, tab_search, tab_category, tab_date, tab_price = st.tabs(
-        ["All Products", "Search by Name", "Filter by Category", "Filter by Date", "Filter by Price"]
+    tab_all, tab_query, tab_search, tab_category, tab_date, tab_price = st.tabs(
+        ["All Products", "Combined Filters", "Search by Name", "Filter by Category", "Filter by Date",
+         "Filter by Price"]
     )
 
     # ---- All Products ----
     with tab_all:
         st.markdown("#### All Products")
-        products = get_all_products(BASE_URL)
-        if products:
+        refresh = st.button("Refresh products", key="refresh_products_btn")
+        products = get_all_products(BASE_URL, force=refresh)
+        if st.session_state.get("products_version") is not None:
+            st.caption(f"Data version {st.session_state['products_version']}; new rows are synced "
+                       f"at most every {PRODUCTS_SYNC_TTL}s, or on refresh.")
+        if has_rows(products):
             df = pd.DataFrame(products)
             st.dataframe(df, use_container_width=True)
         else:
             st.info("No products found.")
 
+    # ---- Combined Filters ----
+    with tab_query:
+        st.markdown("#### Combined Filters")
+        with st.form("query_form"):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                q_name = st.text_input("Name contains")
+                q_category = st.text_input("Category contains")
+                q_location = st.text_input("Customer location")
+            with col2:
+                q_from = st.date_input("From", value=None, key="query_from")
+                q_to = st.date_input("To", value=None, key="query_to")
+                q_status = st.text_input("Status")
+            with col3:
+                q_min = st.number_input("Min price", min_value=0.0, value=None, step=1.0)
+                q_max = st.number_input("Max price", min_value=0.0, value=None, step=1.0)
+                q_payment = st.text_input("Payment method")
+            q_sort = st.selectbox("Sort by", ["date", "-date", "price", "-price", "total_sales", "-total_sales", "name"])
+            q_limit = st.slider("Rows", min_value=10, max_value=1000, value=100, step=10)
+            submitted = st.form_submit_button("Run query")
+        if submitted:
+            params = {
+                "name": q_name.strip() or None,
+                "category": q_category.strip() or None,
+                "location": q_location.strip() or None,
+                "status": q_status.strip() or None,
+                "payment_method": q_payment.strip() or None,
+                "from_date": q_from.isoformat() if q_from else None,
+                "to_date": q_to.isoformat() if q_to else None,
+                "min_price": q_min,
+                "max_price": q_max,
+                "sort": q_sort,
+                "limit": q_limit,
+                "count": "estimate",
+            }
+            df, total = query_products(BASE_URL, {key: value for key, value in params.items() if value is not None})
+            if has_rows(df):
+                st.success(f"Showing {len(df)} of about {total} matching products.")
+                st.dataframe(df, use_container_width=True)
+            elif df is not None:
+                st.info("No products match those filters.")
+
     # ---- Search by Name ----
     with tab_search:
         st.markdown("#### Search by Product Name")
@@ -227,7 +413,7 @@ elif page == "Products: Browse & Filter":
         if st.button("Search", key="search_name_btn"):
             if keyword.strip():
                 data = search_products_by_name(keyword.strip(), BASE_URL)
-                if data:
+                if has_rows(data):
                     df = pd.DataFrame(data)
                     st.success(f"Found {len(df)} matching products.")
                     st.dataframe(df, use_container_width=True)
@@ -245,7 +431,7 @@ elif page == "Products: Browse & Filter":
         if st.button("Filter by Category"):
             if cat_word.strip():
                 data = filter_products_by_category(cat_word.strip(), BASE_URL)
-                if data:
+                if has_rows(data):
                     df = pd.DataFrame(data)
                     st.success(
                         f"Found {len(df)} products in category matching '{cat_word}'."
@@ -271,7 +457,7 @@ elif page == "Products: Browse & Filter":
                 st.warning("From date cannot be after To date.")
             else:
                 data = filter_products_by_date_range(from_date, to_date, BASE_URL)
-                if data:
+                if has_rows(data):
                     df = pd.DataFrame(data)
                     st.success(
                         f"Found {len(df)} products between {from_date} and {to_date}."
@@ -296,7 +482,7 @@ elif page == "Products: Browse & Filter":
                 st.warning("Minimum price cannot be greater than maximum price.")
             else:
                 data = filter_products_by_price(min_price, max_price, BASE_URL)
-                if data:
+                if has_rows(data):
                     df = pd.DataFrame(data)
                     st.success(
                         f"Found {len(df)} products in price range {min_price} – {max_price}."
@@ -312,19 +498,30 @@ elif page == "Products: Browse & Filter":
 elif page == "Customer Analytics":
     st.subheader("Customer Analytics")
 
+    col1, col2 = st.columns(2)
+    with col1:
+        metric = st.selectbox("Rank by", list(CUSTOMER_METRIC_COLUMNS))
+    with col2:
+        top_n = st.number_input("Top N", min_value=5, max_value=500, value=20, step=5)
+
     tab_loc, tab_orders = st.tabs(["By Location", "By Orders"])
+    results = run_concurrently(
+        locations=lambda: get_customers_by_location(BASE_URL, metric, int(top_n)),
+        orders=lambda: get_top_customers_by_orders(BASE_URL, metric, int(top_n)),
+    )
 
     # ---- Customers by Location ----
     with tab_loc:
         st.markdown("#### Customers by Location")
-        data = get_customers_by_location(BASE_URL)
+        data = results["locations"]
         if data:
             df = pd.DataFrame(data)
             st.dataframe(df, use_container_width=True)
 
-            if {"customer_location", "total_customers"} <= set(df.columns):
+            column = CUSTOMER_METRIC_COLUMNS[metric] or "total_customers"
+            if {"customer_location", column} <= set(df.columns):
                 st.bar_chart(
-                    df.set_index("customer_location")["total_customers"],
+                    df.set_index("customer_location")[column],
                     use_container_width=True,
                 )
         else:
@@ -332,15 +529,16 @@ elif page == "Customer Analytics":
 
     # ---- Customers by Number of Orders ----
     with tab_orders:
-        st.markdown("#### Top Customers by Number of Orders")
-        data = get_top_customers_by_orders(BASE_URL)
+        st.markdown(f"#### Top {int(top_n)} Customers by {metric.replace('_', ' ').title()}")
+        data = results["orders"]
         if data:
             df = pd.DataFrame(data)
             st.dataframe(df, use_container_width=True)
 
-            if {"customer_name", "no_of_orders"} <= set(df.columns):
+            column = CUSTOMER_METRIC_COLUMNS[metric] or "no_of_orders"
+            if {"customer_name", column} <= set(df.columns):
                 st.bar_chart(
-                    df.set_index("customer_name")["no_of_orders"],
+                    df.set_index("customer_name")[column],
                     use_container_width=True,
                 )
         else:
@@ -348,21 +546,73 @@ elif page == "Customer Analytics":
 
 
 # =========================
-# PAGE 4: ADMIN – LOAD CSV
+# PAGE 4: SALES TRENDS
+# =========================
+elif page == "Sales Trends":
+    st.subheader("Sales Trends")
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        granularity = st.selectbox("Bucket", ["day", "week", "month"], index=1)
+    with col2:
+        split_label = st.selectbox("Split by", ["None", "category", "status", "payment_method"])
+    with col3:
+        trend_from = st.date_input("From", value=date(2025, 1, 1), key="trend_from")
+    with col4:
+        trend_to = st.date_input("To", value=date(2025, 12, 31), key="trend_to")
+    metric = st.radio("Metric", ["total_sales", "quantity", "orders", "avg_price"], horizontal=True)
+
+    if trend_from > trend_to:
+        st.warning("From date cannot be after To date.")
+    else:
+        split_by = None if split_label == "None" else split_label
+        data = get_revenue_timeseries(BASE_URL, granularity, split_by, trend_from, trend_to)
+        if has_rows(data):
+            df = pd.DataFrame(data)
+            df["bucket"] = pd.to_datetime(df["bucket"])
+            if split_by:
+                chart = df.pivot_table(index="bucket", columns="series", values=metric, aggfunc="sum")
+            else:
+                chart = df.set_index("bucket")[metric]
+            st.line_chart(chart, use_container_width=True)
+            st.dataframe(df, use_container_width=True)
+        else:
+            st.info("No sales in that date range.")
+
+
+# =========================
+# PAGE 5: ADMIN – LOAD CSV
 # =========================
 elif page == "Admin: Load CSV to DB":
     st.subheader("Admin – Load CSV Data into DB")
 
     st.markdown(
         """
-This will call your FastAPI endpoint **POST /load-products**,  
-which reads the CSV from the backend path and inserts rows into the database.
+Uploads are parsed in chunks and inserted by a background job on the backend.
+This page polls **GET /ingest/jobs/{job_id}** until the job finishes.
     """
     )
 
-    if st.button("Trigger /load-products"):
-        result = trigger_load_products(BASE_URL)
-        if result:
-            st.success(f"Response: {result}")
+    incremental = st.checkbox(
+        "Incremental load (skip rows already loaded from this source, upsert changed rows)",
+        value=False,
+    )
+    ingest_mode = "incremental" if incremental else "full"
+
+    st.markdown("#### Upload a CSV file")
+    uploaded = st.file_uploader("Sales CSV", type=["csv"])
+    # The backend keeps the incremental watermark per source, so uploads name theirs explicitly
+    source = st.text_input("Source (the file series this upload continues)", disabled=not incremental)
+    if uploaded is not None and st.button("Upload and load"):
+        if incremental and not source.strip():
+            st.error("Incremental uploads need a source name.")
         else:
-            st.error("Failed to load products. Check logs / backend.")
+            job = upload_csv_file(uploaded, BASE_URL, ingest_mode, source.strip() if incremental else None)
+            if job:
+                show_job_result(poll_ingest_job(job["job_id"], BASE_URL))
+
+    st.markdown("#### Load the backend CSV")
+    if st.button("Load backend CSV"):
+        job = start_server_csv_job(BASE_URL, ingest_mode)
+        if job:
+            show_job_result(poll_ingest_job(job["job_id"], BASE_URL))
@@ -0,0 +1,86 @@
+"""Synthetic orders shaped like database_models.Product.
+
+`write_csv` produces the raw sales CSV the ingest path reads (same headers and dd-mm-YYYY
+dates as the real export); `synthetic_frame` produces already-coerced rows. Both are seeded,
+so a given size always yields the same data.
+
+    python benchmarks/data.py 1000000 orders-1m.csv
+"""
+import argparse
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+
+NAMES = ["Laptop", "Smartphone", "T-Shirt", "Jeans", "Refrigerator", "Novel", "Running Shoes", "Headphones",
+         "Smartwatch", "Blender", "Backpack", "Desk Lamp"]
+CATEGORIES = ["Electronics", "Clothing", "Home Appliances", "Books", "Footwear", "Accessories"]
+LOCATIONS = ["New York", "London", "Mumbai", "Sydney", "Berlin", "Tokyo", "Toronto", "Dubai", "Paris", "Singapore"]
+PAYMENT_METHODS = ["Credit Card", "Debit Card", "PayPal", "Amazon Pay", "Gift Card"]
+STATUSES = ["Completed", "Pending", "Cancelled"]
+
+FIRST_DAY = date(2025, 1, 1)
+DAYS = 365
+CUSTOMERS = 50_000
+
+# CSV headers as in the real sales export (ingest.COLUMN_MAP maps them to column names)
+CSV_HEADERS = ["id", "date", "name", "category", "price", "quantity", "total sales", "customer name",
+               "customer location", "payment method", "status"]
+
+
+def _frame(rows: int, seed: int, start: int, calendar: np.ndarray) -> pd.DataFrame:
+    rng = np.random.default_rng(seed + start)
+    price = np.round(rng.uniform(5, 2000, rows), 2)
+    quantity = rng.integers(1, 6, rows)
+
+    def pick(values):
+        return np.array(values, dtype=object)[rng.integers(0, len(values), rows)]
+
+    return pd.DataFrame({
+        "id": [f"ORD{i:09d}" for i in range(start, start + rows)],
+        "date": calendar[rng.integers(0, DAYS, rows)],
+        "name": pick(NAMES),
+        "category": pick(CATEGORIES),
+        "price": price,
+        "quantity": quantity,
+        "total_sales": (price * quantity).astype("int64"),
+        "customer_name": [f"Customer {n}" for n in rng.integers(1, CUSTOMERS + 1, rows)],
+        "customer_location": pick(LOCATIONS),
+        "payment_method": pick(PAYMENT_METHODS),
+        "status": pick(STATUSES),
+    })
+
+
+def _calendar() -> list:
+    return [date.fromordinal(FIRST_DAY.toordinal() + day) for day in range(DAYS)]
+
+
+def synthetic_frame(rows: int, seed: int = 0, start: int = 0) -> pd.DataFrame:
+    """`rows` coerced product rows (Python dates), ids ORD000000000 + start onwards."""
+    return _frame(rows, seed, start, np.array(_calendar(), dtype=object))
+
+
+def write_csv(path: str, rows: int, seed: int = 0, chunk_rows: int = 500_000):
+    """Write `rows` orders as a sales CSV, a chunk at a time so memory stays flat at 10M rows."""
+    # Same rows as synthetic_frame, with dates pre-formatted once per calendar day
+    calendar = np.array([day.strftime("%d-%m-%Y") for day in _calendar()], dtype=object)
+    with open(path, "w", newline="") as handle:
+        for start in range(0, rows, chunk_rows):
+            frame = _frame(min(chunk_rows, rows - start), seed, start, calendar)
+            frame.columns = CSV_HEADERS
+            frame.to_csv(handle, index=False, header=start == 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic sales CSV.")
+    parser.add_argument("rows", help="row count, or one of " + ", ".join(SIZES))
+    parser.add_argument("path")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_csv(args.path, SIZES.get(args.rows.lower()) or int(args.rows), args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""End-to-end load benchmark: synthetic data, the ingest path, then every read route under concurrency.
+
+Runs in-process against a throwaway SQLite database (or --database-url). The steps are:
+1. Write a synthetic sales CSV (benchmarks/data.py).
+2. Load it through POST /load-products.
+3. Call each route in ROUTES `--requests` times from `--concurrency` concurrent clients, using httpx's ASGI transport.
+
+It reports p50/p95/p99 latency, throughput and peak RSS as JSON. With --baseline, it compares p95 and throughput
+against an earlier result and exits 1 when a route regressed by more than --tolerance.
+
+    python benchmarks/load.py --size 10k --output results.json
+    python benchmarks/load.py --size 1m --baseline results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+from data import SIZES, write_csv
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# (name, method, path); the data spans 2025, so the date filters below select a week / a day
+ROUTES = [
+    ("home", "GET", "/"),
+    ("products.page", "GET", "/products/?limit=100"),
+    ("products.page_projected", "GET", "/products/?limit=1000&fields=id,name,price"),
+    ("products.query", "GET", "/products/query?category=elec&status=Pending&min_price=100&max_price=500"
+                              "&sort=-price&limit=100&count=exact"),
+    ("products.recent", "GET", "/products/recent?limit=50"),
+    ("products.version", "GET", "/products/version"),
+    ("products.changes", "GET", "/products/changes?limit=1000"),
+    ("products.category", "GET", "/products/filter/elec?limit=100"),
+    ("products.search", "GET", "/products/search/phone?limit=100"),
+    ("products.date_range", "GET", "/products/filter/2025-03-01/2025-03-07"),
+    ("products.price_range", "GET", "/products/filter/price/500/490"),
+    ("products.export", "GET", "/products/export?format=ndjson&from_date=2025-03-01&to_date=2025-03-01"),
+    ("customer.by_location", "GET", "/customer/user"),
+    ("customer.by_location_exact", "GET", "/customer/user?exact=true"),
+    ("customer.most_orders", "GET", "/customer/mostorder"),
+    ("customer.most_orders_exact", "GET", "/customer/mostorder?exact=true"),
+    ("customer.most_orders_top", "GET", "/customer/mostorder?limit=20"),
+    ("customer.most_sales_top_exact", "GET", "/customer/mostorder?metric=total_sales&limit=20&exact=true"),
+    ("customer.unique", "GET", "/customer/unique"),
+    ("customer.unique_exact", "GET", "/customer/unique?exact=true"),
+    ("customer.unique_by_location", "GET", "/customer/unique?by=location"),
+    ("customer.unique_by_location_exact", "GET", "/customer/unique?by=location&exact=true"),
+    ("customer.heavy_hitters", "GET", "/customer/heavy-hitters?limit=20"),
+    ("customer.heavy_hitters_exact", "GET", "/customer/heavy-hitters?limit=20&exact=true"),
+    ("analytics.summary", "GET", "/analytics/summary"),
+    ("analytics.timeseries", "GET", "/analytics/timeseries?granularity=week&split_by=category"),
+]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def drive(client, method: str, path: str, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            response = await client.request(method, path)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "throughput_rps": round(requests / elapsed, 1),
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+
+    import main
+    import migrations
+    from database import engine
+
+    await migrations.upgrade(engine)
+    # No lifespan events through ASGITransport; a timeout of None lets 10M-row loads finish
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        started = time.perf_counter()
+        response = await client.post("/load-products", params={"batch_size": args.batch_size})
+        response.raise_for_status()
+        load = response.json()
+        load = {"rows": load["rows"], "rows_failed": load["rows_failed"], "seconds": round(time.perf_counter() - started, 3),
+                "rows_per_second": load["rows_per_second"], "peak_rss_mb": peak_rss_mb()}
+        print(f"loaded {load['rows']} rows in {load['seconds']}s ({load['rows_per_second']} rows/s)", file=sys.stderr)
+
+        routes = {}
+        for name, method, path in ROUTES:
+            if args.routes and name not in args.routes:
+                continue
+            await client.request(method, path)  # warm-up
+            routes[name] = {"path": path, **await drive(client, method, path, args.requests, args.concurrency)}
+            print(f"{name:<30} p50 {routes[name]['p50_ms']:>9} ms  p95 {routes[name]['p95_ms']:>9} ms  "
+                  f"{routes[name]['throughput_rps']:>8} req/s", file=sys.stderr)
+    await engine.dispose()
+    return {"load": load, "routes": routes}
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Routes whose p95 grew, or throughput fell, by more than `tolerance` against the baseline."""
+    regressions = []
+    for name, current in result["routes"].items():
+        before = baseline.get("routes", {}).get(name)
+        if before is None:
+            continue
+        if current["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append({"route": name, "metric": "p95_ms", "baseline": before["p95_ms"],
+                                "current": current["p95_ms"]})
+        if current["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+            regressions.append({"route": name, "metric": "throughput_rps", "baseline": before["throughput_rps"],
+                                "current": current["throughput_rps"]})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="10k", help="row count, or one of " + ", ".join(SIZES))
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients per route")
+    parser.add_argument("--batch-size", type=int, default=5000, help="ingest batch size")
+    parser.add_argument("--routes", nargs="*", help="only these route names")
+    parser.add_argument("--database-url", help="default: a new SQLite file in a temp directory")
+    parser.add_argument("--csv", help="reuse a generated CSV instead of writing a new one")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache on")
+    parser.add_argument("--output", help="write the JSON result here as well as to stdout")
+    parser.add_argument("--baseline", help="earlier JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression, as a fraction")
+    args = parser.parse_args()
+    rows = SIZES.get(args.size.lower()) or int(args.size)
+
+    workdir = tempfile.mkdtemp(prefix="bench-load-")
+    csv_path = args.csv or os.path.join(workdir, "orders.csv")
+    if not args.csv:
+        started = time.perf_counter()
+        write_csv(csv_path, rows)
+        print(f"generated {rows} rows in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    # Settings are read at import time, so they are set before the app is imported
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["PRODUCTS_CSV_PATH"] = csv_path
+    os.environ["RESPONSE_CACHE_ENABLED"] = "true" if args.cache else "false"
+    # The sketch-backed /customer routes are measured next to their exact=true counterparts
+    os.environ.setdefault("SKETCHES_ENABLED", "true")
+
+    result = {
+        "size": rows,
+        "requests_per_route": args.requests,
+        "concurrency": args.concurrency,
+        "database": os.environ["DATABASE_URL"].split(":", 1)[0],
+        "python": platform.python_version(),
+        **asyncio.run(run(args)),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if args.baseline:
+        with open(args.baseline) as handle:
+            result["regressions"] = compare(result, json.load(handle), args.tolerance)
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output + "\n")
+    return 1 if result.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""Response-model serialization vs the orjson fast path (FAST_JSON_ENABLED), end to end.
+
+Loads synthetic products into a throwaway SQLite database, then calls the list routes
+in-process through httpx's ASGI transport, once per path, checking both return the same JSON.
+
+    python benchmarks/serialization.py --rows 50000 --repeat 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from data import synthetic_frame
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ROUTES = [
+    "/products/?limit=1000",
+    "/products/filter/2025-01-01/2025-03-31",
+    "/products/filter/price/2000/0",
+    "/products/search/phone?limit=500",
+    "/customer/mostorder",
+    "/analytics/timeseries?granularity=day&split_by=category",
+]
+
+
+async def run(rows: int, repeat: int) -> dict:
+    import httpx
+
+    import config
+    import ingest
+    import main
+    import migrations
+    from database import AsyncSessionLocal, engine
+
+    await migrations.upgrade(engine)
+    async with AsyncSessionLocal() as db:
+        await ingest.ingest_frame(db, synthetic_frame(rows))
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for route in ROUTES:
+            bodies = {}
+            timings = {}
+            for fast in (False, True):
+                config.FAST_JSON_ENABLED = fast
+                response = await client.get(route)
+                response.raise_for_status()
+                bodies[fast] = response.json()
+                samples = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    await client.get(route)
+                    samples.append((time.perf_counter() - start) * 1000)
+                timings["fast" if fast else "model"] = round(statistics.median(samples), 3)
+            if bodies[False] != bodies[True]:
+                raise AssertionError(f"{route}: fast path returned different JSON")
+            results[route] = {
+                "items": len(bodies[True]["items"] if isinstance(bodies[True], dict) else bodies[True]),
+                "model_ms": timings["model"],
+                "fast_ms": timings["fast"],
+                "speedup": round(timings["model"] / timings["fast"], 2),
+            }
+    await engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-serialization-")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}"
+    # Measure serialization, not the response cache
+    os.environ["RESPONSE_CACHE_ENABLED"] = "false"
+    os.environ["SEARCH_INDEX_ENABLED"] = "false"
+
+    results = asyncio.run(run(args.rows, args.repeat))
+    print(f"{'route':<55} {'items':>6} {'model ms':>9} {'fast ms':>8} {'x':>6}")
+    for route, result in results.items():
+        print(f"{route:<55} {result['items']:>6} {result['model_ms']:>9} {result['fast_ms']:>8} {result['speedup']:>6}")
+    print(json.dumps({"rows": args.rows, "repeat": args.repeat, "routes": results}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Response cache for the read routes, with ETag / 304 support.
+
+Responses are cached per (path, query string, Accept header) with LRU eviction and a TTL.
+The data only changes when an ingest batch commits, so ingest calls `cache.invalidate()`,
+which bumps the data version and drops every entry. The cache is per worker process;
+the TTL bounds how stale another worker's entries can get after an ingest.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from fastapi import APIRouter
+
+import config
+
+# Route prefixes whose GET responses are cached, and exceptions: streaming endpoints, and the
+# delta-sync routes, whose version and changes must be read together from the live table
+CACHED_PREFIXES = ("/products", "/customer", "/analytics")
+UNCACHED_PREFIXES = ("/products/export", "/products/version", "/products/changes")
+
+
+class CachedResponse(NamedTuple):
+    expires: float
+    etag: bytes
+    status: int
+    headers: list
+    body: bytes
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int, ttl: float, max_body_bytes: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_body_bytes = max_body_bytes
+        self.entries: "OrderedDict[tuple, CachedResponse]" = OrderedDict()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def invalidate(self):
+        self.version += 1
+        self.entries.clear()
+
+    def get(self, key: tuple) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key: tuple, entry: CachedResponse):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": config.RESPONSE_CACHE_ENABLED,
+            "data_version": self.version,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+cache = ResponseCache(config.RESPONSE_CACHE_MAX_ENTRIES, config.RESPONSE_CACHE_TTL_SECONDS,
+                      config.RESPONSE_CACHE_MAX_BODY_BYTES)
+
+
+def make_etag(body: bytes) -> bytes:
+    # Content hash, so an unchanged result still revalidates after an ingest bumped the version
+    return f'"{hashlib.sha1(body).hexdigest()[:20]}"'.encode()
+
+
+def etag_matches(if_none_match: Optional[bytes], etag: bytes) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(b",")]
+    return b"*" in candidates or any(tag.removeprefix(b"W/") == etag for tag in candidates)
+
+
+def _cacheable(path: str) -> bool:
+    return path.startswith(CACHED_PREFIXES) and not path.startswith(UNCACHED_PREFIXES)
+
+
+class ResponseCacheMiddleware:
+    """Pure ASGI middleware: serves cached GET responses and answers matching If-None-Match with 304."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (not config.RESPONSE_CACHE_ENABLED or scope["type"] != "http" or scope["method"] != "GET"
+                or not _cacheable(scope["path"])):
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        key = (scope["path"], scope["query_string"], headers.get(b"accept", b""))
+        if_none_match = headers.get(b"if-none-match")
+
+        entry = None if b"no-cache" in headers.get(b"cache-control", b"") else cache.get(key)
+        if entry is not None:
+            if etag_matches(if_none_match, entry.etag):
+                cache.not_modified += 1
+                return await self._send_not_modified(send, entry.etag)
+            cache.hits += 1
+            await send({"type": "http.response.start", "status": entry.status,
+                        "headers": entry.headers + [(b"x-cache", b"HIT")]})
+            return await send({"type": "http.response.body", "body": entry.body})
+
+        cache.misses += 1
+        version = cache.version
+        start = {}
+        chunks = []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, capture)
+        body = b"".join(chunks)
+        status = start["status"]
+        response_headers = [(name, value) for name, value in start.get("headers", []) if name.lower() != b"etag"]
+        if status != 200:
+            await send({"type": "http.response.start", "status": status, "headers": response_headers})
+            return await send({"type": "http.response.body", "body": body})
+
+        etag = make_etag(body)
+        response_headers.append((b"etag", etag))
+        # Don't store a result computed while an ingest was committing
+        if version == cache.version and len(body) <= cache.max_body_bytes:
+            cache.put(key, CachedResponse(time.monotonic() + cache.ttl, etag, status, response_headers, body))
+        if etag_matches(if_none_match, etag):
+            cache.not_modified += 1
+            return await self._send_not_modified(send, etag)
+        await send({"type": "http.response.start", "status": status,
+                    "headers": response_headers + [(b"x-cache", b"MISS")]})
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def _send_not_modified(send, etag: bytes):
+        await send({"type": "http.response.start", "status": 304, "headers": [(b"etag", etag)]})
+        await send({"type": "http.response.body", "body": b""})
+
+
+router = APIRouter(prefix="/cache", tags=["Cache"])
+
+
+@router.get("/stats")
+async def cache_stats():
+    return cache.stats()
+
+
+@router.post("/clear")
+async def clear_cache():
+    cache.invalidate()
+    return cache.stats()
@@ -0,0 +1,75 @@
+"""Apache Arrow IPC / Parquet responses, chosen by the request's Accept header.
+
+pyarrow is optional: without it `negotiate()` always returns None and the routes answer
+with JSON as before.
+"""
+from typing import List, Optional
+
+from fastapi import Request, Response
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+    pq = None
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+PARQUET = "application/vnd.apache.parquet"
+
+
+def negotiate(request: Request) -> Optional[str]:
+    """The columnar media type the client asked for, or None for JSON."""
+    if pa is None:
+        return None
+    accept = request.headers.get("accept", "")
+    if ARROW_STREAM in accept:
+        return ARROW_STREAM
+    if PARQUET in accept:
+        return PARQUET
+    return None
+
+
+def arrow_type(sql_type):
+    """Arrow type for a SQLAlchemy column type."""
+    python_type = sql_type.python_type
+    if python_type is int:
+        return pa.int64()
+    if python_type is float:
+        return pa.float64()
+    if python_type.__name__ == "datetime":
+        return pa.timestamp("us")
+    if python_type.__name__ == "date":
+        return pa.date32()
+    return pa.string()
+
+
+def _array(values, arrow_type):
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # e.g. SQLite returns computed dates as ISO strings
+        return pa.array(values).cast(arrow_type)
+
+
+def rows_to_table(rows, names: List[str], types: dict) -> "pa.Table":
+    """Build a table column by column from result rows (tuples in `names` order)."""
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    return pa.table({name: _array(list(values), types[name]) for name, values in zip(names, columns)})
+
+
+def table_response(table: "pa.Table", media_type: str, headers: dict = None) -> Response:
+    sink = pa.BufferOutputStream()
+    if media_type == PARQUET:
+        pq.write_table(table, sink)
+    else:
+        # Buffer compression is transparent to readers and shrinks the repetitive string columns
+        codec = "zstd" if pa.Codec.is_available("zstd") else None
+        options = pa.ipc.IpcWriteOptions(compression=codec)
+        with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+    return Response(content=sink.getvalue().to_pybytes(), media_type=media_type, headers=headers)
+
+
+def rows_response(rows, names: List[str], types: dict, media_type: str, headers: dict = None) -> Response:
+    return table_response(rows_to_table(rows, names, types), media_type, headers)
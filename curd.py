@@ -1,6 +1,9 @@
+import json
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from database_models import Product
+from sqlalchemy import (select, insert, delete, or_, tuple_, func, desc, and_, cast, Date, literal_column, null, table,
+                        column)
+from sqlalchemy.dialects import postgresql, sqlite
+from database_models import Product, CustomerLocationRollup, CustomerNameRollup, db_now
 
 
 async def create_product(db: AsyncSession, product_data: dict):
@@ -11,6 +14,338 @@ async def create_product(db: AsyncSession, product_data: dict):
     return db_product
 
 
+async def bulk_create_products(db: AsyncSession, records: list):
+    # executemany on a Core insert is sent as multi-row INSERT ... VALUES statements
+    await db.execute(insert(Product), records)
+
+
+async def copy_products(db: AsyncSession, records: list):
+    # COPY is only available on asyncpg, other drivers fall back to multi-row INSERT
+    conn = await db.connection()
+    if conn.dialect.driver != "asyncpg":
+        return await bulk_create_products(db, records)
+    # loaded_at is filled in by the column's server default (the database clock)
+    columns = [column.name for column in Product.__table__.columns if column.name != "loaded_at"]
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        Product.__tablename__,
+        records=[tuple(record[name] for name in columns) for record in records],
+        columns=columns,
+    )
+
+
+def dialect_insert(conn):
+    # insert() with on_conflict_do_update / on_conflict_do_nothing for the connected database
+    return sqlite.insert if conn.dialect.name == "sqlite" else postgresql.insert
+
+
+async def upsert_products(db: AsyncSession, records: list):
+    # INSERT ... ON CONFLICT (id) DO UPDATE, touching only rows whose values actually changed
+    conn = await db.connection()
+    stmt = dialect_insert(conn)(Product)
+    table = Product.__table__
+    columns = [column for column in table.columns if not column.primary_key]
+    if len(table.primary_key.columns) > 1:
+        # Partitioned table, keyed on (id, date): drop the old version of rows whose date moved,
+        # or the upsert would insert them alongside it
+        await db.execute(delete(Product).where(
+            Product.id.in_([record["id"] for record in records]),
+            tuple_(Product.id, Product.date).notin_([(record["id"], record["date"]) for record in records])))
+    # loaded_at is restamped by the database on every real change, so it is not compared
+    compared = [column for column in columns if column.name != "loaded_at"]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(table.primary_key.columns),
+        set_={**{column.name: stmt.excluded[column.name] for column in compared}, "loaded_at": db_now()},
+        where=or_(*[column.is_distinct_from(stmt.excluded[column.name]) for column in compared]),
+    )
+    await db.execute(stmt, records)
+
+
 async def get_products(db: AsyncSession):
     result = await db.execute(select(Product))
-    return result.scalars().all()
\ No newline at end of file
+    return result.scalars().all()
+
+
+
+def get_products_page_query(limit: int, after: tuple = None, columns: list = None):
+    # Keyset pagination over (date, id): each page is an index range scan, whatever the offset
+    columns = columns or list(Product.__table__.columns)
+    query = select(*columns).order_by(Product.date, Product.id).limit(limit)
+    if after is not None:
+        query = query.where(tuple_(Product.date, Product.id) > tuple_(*after))
+    return query
+
+
+async def get_products_page(db: AsyncSession, limit: int, after: tuple = None, columns: list = None):
+    result = await db.execute(get_products_page_query(limit, after, columns))
+    return result.all()
+
+
+def _like_pattern(keyword: str) -> str:
+    escaped = keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def search_products_query(column, keyword: str, dialect_name: str):
+    if dialect_name == "postgresql":
+        # pg_trgm similarity: closest overall match first
+        rank = func.similarity(column, keyword).desc()
+    else:
+        # SQLite fallback: earliest match position first
+        rank = func.instr(func.lower(column), keyword.lower())
+    return (select(Product.__table__)
+            .where(column.ilike(_like_pattern(keyword), escape="\\"))
+            .order_by(rank, func.length(column), Product.id))
+
+
+async def search_products(db: AsyncSession, column, keyword: str, limit: int, offset: int = 0):
+    """Case-insensitive substring search on `column`, best matches first."""
+    conn = await db.connection()
+    query = search_products_query(column, keyword, conn.dialect.name).limit(limit).offset(offset)
+    result = await db.execute(query)
+    return result.all()
+
+
+def products_between_dates_query(from_date, to_date):
+    return select(Product.__table__).where(Product.date.between(from_date, to_date))
+
+
+def products_by_price_query(min_price: float, max_price: float):
+    return (select(Product.name, Product.price, Product.category)
+            .where(and_(Product.price <= max_price, Product.price >= min_price))
+            .order_by(desc(Product.price)))
+
+
+# Ranking metrics of the /customer routes -> rollup column
+CUSTOMER_METRICS = {"orders": "order_count", "total_sales": "total_sales", "quantity": "total_quantity"}
+
+
+def _rank(query, key, order_count, metric_column, min_count: int = None, limit: int = None, offset: int = 0,
+          having: bool = True):
+    # ORDER BY metric DESC LIMIT n lets the database keep a top-N heap instead of sorting every group;
+    # the key breaks ties so pages don't overlap
+    if min_count:
+        condition = order_count >= min_count
+        query = query.having(condition) if having else query.where(condition)
+    query = query.order_by(desc(metric_column), key)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.offset(offset) if offset else query
+
+
+def _sums():
+    return (func.coalesce(func.sum(Product.total_sales), 0).label("total_sales"),
+            func.coalesce(func.sum(Product.quantity), 0).label("total_quantity"))
+
+
+def customers_by_location_query(metric: str = "orders", min_count: int = None, limit: int = None, offset: int = 0):
+    # Orders per location, counted like the rollup: every row with a location
+    count = func.count().label("total_customers")
+    sales, quantity = _sums()
+    query = (select(Product.customer_location, count, sales, quantity)
+             .where(Product.customer_location.isnot(None)).group_by(Product.customer_location))
+    return _rank(query, Product.customer_location, count, {"orders": count, "total_sales": sales,
+                 "quantity": quantity}[metric], min_count, limit, offset)
+
+
+def orders_by_customer_query(metric: str = "orders", min_count: int = None, limit: int = None, offset: int = 0):
+    count = func.count().label("no_of_orders")
+    sales, quantity = _sums()
+    query = (select(Product.customer_name, count, sales, quantity)
+             .where(Product.customer_name.isnot(None)).group_by(Product.customer_name))
+    return _rank(query, Product.customer_name, count, {"orders": count, "total_sales": sales,
+                 "quantity": quantity}[metric], min_count, limit, offset)
+
+
+# Same results as the two queries above, read from the rollups maintained by ingest
+def customers_by_location_rollup_query(metric: str = "orders", min_count: int = None, limit: int = None,
+                                       offset: int = 0):
+    table = CustomerLocationRollup.__table__
+    query = select(table.c.customer_location, table.c.order_count.label("total_customers"),
+                   table.c.total_sales, table.c.total_quantity)
+    return _rank(query, table.c.customer_location, table.c.order_count,
+                 table.c[CUSTOMER_METRICS[metric]], min_count, limit, offset, having=False)
+
+
+def orders_by_customer_rollup_query(metric: str = "orders", min_count: int = None, limit: int = None,
+                                    offset: int = 0):
+    table = CustomerNameRollup.__table__
+    query = select(table.c.customer_name, table.c.order_count.label("no_of_orders"),
+                   table.c.total_sales, table.c.total_quantity)
+    return _rank(query, table.c.customer_name, table.c.order_count,
+                 table.c[CUSTOMER_METRICS[metric]], min_count, limit, offset, having=False)
+
+
+def unique_customers_query(column_name: str = None):
+    # Exact distinct customers, overall (key NULL) or grouped by a Product column
+    count = func.count(func.distinct(Product.customer_name)).label("unique_customers")
+    if column_name is None:
+        return select(null().label("key"), count)
+    column = Product.__table__.c[column_name]
+    return select(column.label("key"), count).where(column.isnot(None)).group_by(column).order_by(desc(count))
+
+
+async def get_products_by_ids(db: AsyncSession, ids: list):
+    # Primary key lookups, returned in the order of `ids`
+    if not ids:
+        return []
+    result = await db.execute(select(Product.__table__).where(Product.id.in_(ids)))
+    by_id = {row.id: row for row in result}
+    return [by_id[product_id] for product_id in ids if product_id in by_id]
+
+
+def date_bucket(granularity: str, dialect_name: str):
+    """Product.date truncated to the start of its day / week (Monday) / month."""
+    if granularity not in ("day", "week", "month"):
+        raise ValueError(f"Unsupported granularity: {granularity}")
+    if dialect_name == "postgresql":
+        # Inlined (granularity is validated by the route) so SELECT and GROUP BY render the same expression
+        return cast(func.date_trunc(literal_column(f"'{granularity}'"), Product.date), Date)
+    # SQLite fallback
+    if granularity == "week":
+        return func.date(Product.date, "weekday 0", "-6 days")
+    if granularity == "month":
+        return func.date(Product.date, "start of month")
+    return func.date(Product.date)
+
+
+def revenue_timeseries_query(granularity: str, dialect_name: str, split_column=None, from_date=None, to_date=None):
+    bucket = date_bucket(granularity, dialect_name).label("bucket")
+    columns = [bucket]
+    group_by = [bucket]
+    if split_column is not None:
+        columns.append(split_column.label("series"))
+        group_by.append(split_column)
+    query = select(
+        *columns,
+        func.coalesce(func.sum(Product.total_sales), 0).label("total_sales"),
+        func.coalesce(func.sum(Product.quantity), 0).label("quantity"),
+        func.count().label("orders"),
+        func.avg(Product.price).label("avg_price"),
+    )
+    if from_date is not None:
+        query = query.where(Product.date >= from_date)
+    if to_date is not None:
+        query = query.where(Product.date <= to_date)
+    return query.group_by(*group_by).order_by(*group_by)
+
+
+_pg_stat_activity = table("pg_stat_activity", column("xact_start"), column("datname"), column("pid"),
+                          column("backend_type"), column("backend_xid"))
+
+
+def change_horizon(dialect_name: str):
+    """Upper bound (exclusive) on the loaded_at values delta sync may hand out, or None for no bound.
+
+    On PostgreSQL a row is stamped after its transaction has taken a write xid (database_models.db_now),
+    so an open writer can still commit rows stamped as early as its start. Below the oldest start of
+    a client transaction holding a write xid no more rows can appear; readers (exports, the search
+    index build, this request), autovacuum and other background workers don't hold the horizon back.
+    With no writer open, rows committed before this statement are all visible, so its start bounds
+    them. SQLite has a single writer, which commits before the next one can stamp rows.
+    """
+    if dialect_name != "postgresql":
+        return None
+    activity = _pg_stat_activity.c
+    oldest_writer = (select(func.min(activity.xact_start))
+                     .where(activity.datname == func.current_database(),
+                            activity.backend_type == "client backend",
+                            activity.pid != func.pg_backend_pid(),
+                            activity.backend_xid.is_not(None))
+                     .scalar_subquery())
+    return func.coalesce(oldest_writer, func.statement_timestamp())
+
+
+def product_version_query(horizon=None):
+    query = select(func.max(Product.loaded_at))
+    return query if horizon is None else query.where(Product.loaded_at < horizon)
+
+
+def product_changes_query(limit: int, since=None, after: tuple = None, horizon=None):
+    # Rows written by ingest after `since`, keyset-paginated over (loaded_at, id)
+    query = select(Product.__table__)
+    if horizon is not None:
+        query = query.where(Product.loaded_at < horizon)
+    if since is not None:
+        query = query.where(Product.loaded_at > since)
+    if after is not None:
+        query = query.where(tuple_(Product.loaded_at, Product.id) > tuple_(*after))
+    return query.order_by(Product.loaded_at, Product.id).limit(limit)
+
+
+def kpi_summary_query(unique_customers: bool = True):
+    # One pass over the table for every KPI on the dashboard's Overview page; the distinct
+    # count (a sort or hash of every name) can be left out when a sketch answers it
+    columns = [
+        func.count().label("orders"),
+        func.coalesce(func.sum(Product.total_sales), 0).label("total_sales"),
+        func.avg(Product.price).label("avg_price"),
+    ]
+    if unique_customers:
+        columns.append(func.count(func.distinct(Product.customer_name)).label("unique_customers"))
+    return select(*columns)
+
+
+def recent_products_query(limit: int):
+    # Backward scan of ix_ecommerse_product_date_id
+    return select(Product.__table__).order_by(desc(Product.date), desc(Product.id)).limit(limit)
+
+
+def product_filters(category: str = None, name: str = None, from_date=None, to_date=None,
+                    min_price: float = None, max_price: float = None, status: str = None,
+                    payment_method: str = None, location: str = None) -> list:
+    """WHERE conditions shared by the product routes; filters left as None are skipped."""
+    conditions = []
+    if category:
+        conditions.append(Product.category.ilike(_like_pattern(category), escape="\\"))
+    if name:
+        conditions.append(Product.name.ilike(_like_pattern(name), escape="\\"))
+    if from_date is not None:
+        conditions.append(Product.date >= from_date)
+    if to_date is not None:
+        conditions.append(Product.date <= to_date)
+    if min_price is not None:
+        conditions.append(Product.price >= min_price)
+    if max_price is not None:
+        conditions.append(Product.price <= max_price)
+    if status:
+        conditions.append(Product.status == status)
+    if payment_method:
+        conditions.append(Product.payment_method == payment_method)
+    if location:
+        conditions.append(Product.customer_location == location)
+    return conditions
+
+
+# sort= values accepted by GET /products/query; id breaks ties so pages are stable
+PRODUCT_SORTS = {
+    "date": [Product.date, Product.id],
+    "-date": [desc(Product.date), desc(Product.id)],
+    "price": [Product.price, Product.id],
+    "-price": [desc(Product.price), desc(Product.id)],
+    "total_sales": [Product.total_sales, Product.id],
+    "-total_sales": [desc(Product.total_sales), desc(Product.id)],
+    "name": [Product.name, Product.id],
+}
+
+
+def product_query(conditions: list, sort: str = "date", limit: int = None, offset: int = 0, columns: list = None):
+    query = select(*(columns or [Product.__table__])).where(*conditions).order_by(*PRODUCT_SORTS[sort])
+    if limit is not None:
+        query = query.limit(limit)
+    return query.offset(offset) if offset else query
+
+
+def product_count_query(conditions: list):
+    return select(func.count()).select_from(Product).where(*conditions)
+
+
+async def estimate_count(db: AsyncSession, conditions: list) -> int:
+    """Planner row estimate for the filters (PostgreSQL), read from EXPLAIN instead of counting rows."""
+    conn = await db.connection()
+    statement = select(Product.id).where(*conditions)
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    plan = (await conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + sql)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
@@ -1,37 +1,92 @@
-from fastapi import APIRouter,Depends
+from fastapi import APIRouter,Depends,HTTPException,Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_db
-import main,curd,database
-from typing import List
+from database import get_read_db
+import curd,config,fastjson,metrics,sketches
+from typing import List, Optional
 
-from sqlalchemy import select,func,desc
-
-router = APIRouter(prefix="/customer",tags=["Customers"])
+router = APIRouter(prefix="/customer",tags=["Customers"],route_class=metrics.TimedRoute)
 
 
 from pydantic import BaseModel
 class CustomerLocationCount(BaseModel):
     customer_location: str
     total_customers: int
+    total_sales: int
+    total_quantity: int
 
 
-@router.get("/user",response_model=List[CustomerLocationCount])
-async def most_customer_by_contry(db:AsyncSession=Depends(get_db)):
+def ranking(metric:str=Query("orders",pattern="^(orders|total_sales|quantity)$"),
+            min_count:Optional[int]=Query(None,ge=1,description="only groups with at least this many orders"),
+            limit:Optional[int]=Query(None,ge=1,le=config.CUSTOMER_MAX_PAGE_SIZE),
+            offset:int=Query(0,ge=0)) -> dict:
+    # Shared by the ranking routes: rank by `metric` descending, optionally only the top `limit` from `offset`
+    return {"metric": metric, "min_count": min_count, "limit": limit, "offset": offset}
 
-    query = (select(main.Product.customer_location,func.count(main.Product.customer_name).label("total_customers"))
-             .group_by(main.Product.customer_location)).order_by(desc("total_customers"))
+
+@router.get("/user",response_model=List[CustomerLocationCount])
+async def most_customer_by_contry(exact:bool=False,rank:dict=Depends(ranking),db:AsyncSession=Depends(get_read_db)):
+    # exact=true groups the fact table instead of reading the rollup
+    query = curd.customers_by_location_query(**rank) if exact else curd.customers_by_location_rollup_query(**rank)
 
     result = await db.execute(query)
+    if fastjson.enabled():
+        return fastjson.rows_response(result.all(), list(result.keys()))
     return result.all()
 
 class Customer_order_count(BaseModel):
     customer_name:str
     no_of_orders:int
+    total_sales:int
+    total_quantity:int
 
 @router.get("/mostorder",response_model=List[Customer_order_count])
-async def most_ordered_customer(db:AsyncSession=Depends(get_db)):
-
-    query = (select(main.Product.customer_name,func.count(main.Product.id).label("no_of_orders"))
-             .group_by(main.Product.customer_name).order_by(desc("no_of_orders")))
+async def most_ordered_customer(exact:bool=False,rank:dict=Depends(ranking),db:AsyncSession=Depends(get_read_db)):
+    query = curd.orders_by_customer_query(**rank) if exact else curd.orders_by_customer_rollup_query(**rank)
     result = await db.execute(query)
-    return result.all()
\ No newline at end of file
+    if fastjson.enabled():
+        return fastjson.rows_response(result.all(), list(result.keys()))
+    return result.all()
+
+
+class UniqueCustomers(BaseModel):
+    key: Optional[str] = None
+    unique_customers: int
+    # Half-width of the interval holding the true count with probability `confidence` (0 when exact)
+    error_bound: int
+    confidence: float
+
+class HeavyHitter(BaseModel):
+    customer_name: str
+    no_of_orders: int
+    # Count-Min estimates never undercount; they overcount by at most error_bound with probability `confidence`
+    error_bound: int
+    confidence: float
+
+SKETCHES_MISSING = "Sketches are not built: set SKETCHES_ENABLED=true and run `python sketches.py rebuild`"
+
+
+@router.get("/unique",response_model=List[UniqueCustomers])
+async def unique_customers(by:Optional[str]=Query(None,pattern="^(location|category)$"),exact:bool=False,
+                           db:AsyncSession=Depends(get_read_db)):
+    """Distinct customers overall or per location / category, from the HyperLogLog sketches unless exact=true."""
+    if exact:
+        result = await db.execute(curd.unique_customers_query(sketches.SPLITS[by][0] if by else None))
+        return [{"key": key, "unique_customers": count, "error_bound": 0, "confidence": 1.0} for key, count in result]
+    estimates = await sketches.unique_customers(db, by)
+    if estimates is None:
+        raise HTTPException(status_code=404, detail=SKETCHES_MISSING)
+    return estimates
+
+
+@router.get("/heavy-hitters",response_model=List[HeavyHitter])
+async def heavy_hitters(limit:int=Query(10,ge=1,le=config.SKETCH_TOP_K),exact:bool=False,
+                        db:AsyncSession=Depends(get_read_db)):
+    """Customers with the most orders, from the Count-Min sketch and its top-K table unless exact=true."""
+    if exact:
+        result = await db.execute(curd.orders_by_customer_rollup_query(limit=limit))
+        return [{"customer_name": row.customer_name, "no_of_orders": row.no_of_orders, "error_bound": 0,
+                 "confidence": 1.0} for row in result]
+    hitters = await sketches.heavy_hitters(db, limit)
+    if hitters is None:
+        raise HTTPException(status_code=404, detail=SKETCHES_MISSING)
+    return hitters
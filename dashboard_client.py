@@ -0,0 +1,106 @@
+"""HTTP client used by the Streamlit dashboard (app.py).
+
+One pooled requests.Session per API base URL keeps connections alive between calls and
+reruns, accepts gzip, and retries idempotent calls with exponential backoff. fetch_concurrently
+runs a view's independent calls on a thread pool, so a page waits for its slowest call
+rather than for the sum of them.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Columnar media type the backend serves when pyarrow is installed on both sides
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+# (connect, read) seconds
+DEFAULT_TIMEOUT = (3.05, 15)
+
+
+class ApiError(Exception):
+    """A call failed: connection error, timeout, error status or unparseable body."""
+
+
+class DashboardClient:
+    def __init__(self, base_url: str, retries: int = 3, backoff: float = 0.3, pool_size: int = 10):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            # POSTs start ingest jobs, so they are never replayed
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+
+    def request(self, method: str, endpoint: str, timeout=DEFAULT_TIMEOUT, as_frame: bool = False, **kwargs):
+        """Parsed JSON body, or a DataFrame with as_frame=True (fetched as an Arrow stream when possible)."""
+        if as_frame and pa is not None:
+            kwargs["headers"] = {**kwargs.get("headers", {}), "Accept": ARROW_STREAM}
+        try:
+            resp = self.session.request(method=method, url=f"{self.base_url}{endpoint}", timeout=timeout, **kwargs)
+        except requests.RequestException as e:
+            raise ApiError(f"Request failed: {e}") from e
+
+        if not resp.ok:
+            raise ApiError(f"API error [{resp.status_code}]: {resp.text}")
+
+        if as_frame and resp.headers.get("content-type", "").startswith(ARROW_STREAM):
+            return arrow_to_frame(resp)
+
+        try:
+            data = resp.json()
+        except ValueError as e:
+            raise ApiError("Failed to parse JSON response.") from e
+        return json_to_frame(data) if as_frame else data
+
+    def close(self):
+        self.session.close()
+
+
+def arrow_to_frame(resp) -> pd.DataFrame:
+    table = pa.ipc.open_stream(resp.content).read_all()
+    # date32 columns become datetime64 directly; self_destruct frees Arrow buffers as pandas takes them
+    df = table.to_pandas(date_as_object=False, split_blocks=True, self_destruct=True)
+    df.attrs["next_cursor"] = resp.headers.get("X-Next-Cursor")
+    return df
+
+
+def json_to_frame(data) -> pd.DataFrame:
+    # /products/ wraps its rows in {"items": [...], "next_cursor": ...}
+    next_cursor = None
+    if isinstance(data, dict):
+        next_cursor = data.get("next_cursor")
+        data = data.get("items", [])
+    df = pd.DataFrame(data)
+    for column in ("date", "bucket", "loaded_at"):
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column])
+    df.attrs["next_cursor"] = next_cursor
+    return df
+
+
+def fetch_concurrently(calls: Dict[str, Callable[[], object]], max_workers: int = 8,
+                       initializer: Optional[Callable[[], None]] = None) -> dict:
+    """Run independent zero-argument calls on a thread pool; returns {name: result}.
+
+    An exception raised by a call is re-raised here once every call has finished.
+    """
+    if not calls:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(calls)), initializer=initializer) as pool:
+        futures = {name: pool.submit(call) for name, call in calls.items()}
+    return {name: future.result() for name, future in futures.items()}
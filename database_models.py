@@ -1,12 +1,43 @@
-from sqlalchemy import Column, String, Integer, Float, Date
+from sqlalchemy import Column, String, Integer, BigInteger, Float, Date, DateTime, Index, DDL, LargeBinary, event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 from database import Base
+import config
+
+
+class db_now(FunctionElement):
+    """The database's clock: write time on PostgreSQL, statement time on SQLite."""
+    type = DateTime()
+    inherit_cache = True
+
+
+# Takes the transaction's write xid before reading the clock, so a writer shows up in
+# pg_stat_activity.backend_xid before any row it stamps exists (see curd.change_horizon)
+PG_WRITE_CLOCK = "CASE WHEN txid_current() IS NOT NULL THEN clock_timestamp() END"
+
+
+@compiles(db_now)
+def _db_now_default(element, compiler, **kw):
+    return "now()"
+
+
+@compiles(db_now, "postgresql")
+def _db_now_postgresql(element, compiler, **kw):
+    return PG_WRITE_CLOCK
+
+
+@compiles(db_now, "sqlite")
+def _db_now_sqlite(element, compiler, **kw):
+    # In the format SQLAlchemy stores DateTime in on SQLite, so stamps compare correctly as text
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
 
 
 class Product(Base):
     __tablename__ = "ecommerse_product"
 
     id = Column(String, primary_key=True)
-    date = Column(Date)
+    # Partitioned tables need the partition key in the primary key (see partitions.py)
+    date = Column(Date, primary_key=config.PRODUCT_PARTITIONING)
     name = Column(String)
     category = Column(String)
     price = Column(Float)
@@ -16,3 +47,104 @@ class Product(Base):
     customer_location = Column(String)
     payment_method = Column(String)
     status = Column(String)
+    # When ingest last wrote the row (new or changed), from the database clock so concurrent writers
+    # agree on the order; drives GET /products/changes
+    loaded_at = Column(DateTime, default=db_now(), server_default=db_now())
+
+    __table_args__ = (
+        # keyset pagination of GET /products/
+        Index("ix_ecommerse_product_date_id", "date", "id"),
+        # substring search (ILIKE '%word%') on PostgreSQL; plain B-tree indexes elsewhere
+        Index("ix_ecommerse_product_name_trgm", "name",
+              postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"}),
+        Index("ix_ecommerse_product_category_trgm", "category",
+              postgresql_using="gin", postgresql_ops={"category": "gin_trgm_ops"}),
+        # price range ordered by price desc (backward scan), covering name/category for index-only scans
+        Index("ix_ecommerse_product_price_name_category", "price", "name", "category"),
+        # GROUP BY customer_location / customer_name in customer.py
+        Index("ix_ecommerse_product_location_customer", "customer_location", "customer_name"),
+        Index("ix_ecommerse_product_customer_id", "customer_name", "id"),
+        # delta sync: keyset over (loaded_at, id), and max(loaded_at) for GET /products/version
+        Index("ix_ecommerse_product_loaded_at_id", "loaded_at", "id"),
+        # monthly partitions by date on PostgreSQL when PRODUCT_PARTITIONING is on
+        {"postgresql_partition_by": "RANGE (date)"} if config.PRODUCT_PARTITIONING else {},
+    )
+
+
+# gin_trgm_ops needs the pg_trgm extension before the indexes are created
+PG_TRGM = DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql")
+event.listen(Product.__table__, "before_create", PG_TRGM)
+
+
+class IngestWatermark(Base):
+    """How far each CSV source has been loaded by incremental ingest."""
+    __tablename__ = "ingest_watermark"
+
+    source = Column(String, primary_key=True)
+    max_date = Column(Date)
+    file_offset = Column(BigInteger, default=0)
+    tail_hash = Column(String)
+    rows_loaded = Column(BigInteger, default=0)
+    updated_at = Column(DateTime)
+
+
+class SchemaMigration(Base):
+    """Versions applied by migrations.py."""
+    __tablename__ = "schema_migrations"
+
+    version = Column(Integer, primary_key=True)
+    description = Column(String)
+    applied_at = Column(DateTime)
+
+
+# Rollups of ecommerse_product maintained by the ingest path (see rollups.py)
+
+class CustomerLocationRollup(Base):
+    __tablename__ = "customer_location_rollup"
+
+    customer_location = Column(String, primary_key=True)
+    order_count = Column(BigInteger, nullable=False, default=0)
+    total_sales = Column(BigInteger, nullable=False, default=0)
+    total_quantity = Column(BigInteger, nullable=False, default=0)
+    distinct_customers = Column(BigInteger, nullable=False, default=0)
+
+
+class CustomerNameRollup(Base):
+    __tablename__ = "customer_name_rollup"
+
+    customer_name = Column(String, primary_key=True)
+    order_count = Column(BigInteger, nullable=False, default=0)
+    total_sales = Column(BigInteger, nullable=False, default=0)
+    total_quantity = Column(BigInteger, nullable=False, default=0)
+    distinct_locations = Column(BigInteger, nullable=False, default=0)
+
+
+class CustomerLocationMember(Base):
+    """Orders per (location, customer); backs the distinct counts of the two rollups."""
+    __tablename__ = "customer_location_member"
+
+    customer_location = Column(String, primary_key=True)
+    customer_name = Column(String, primary_key=True)
+    order_count = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_customer_location_member_name", "customer_name"),
+    )
+
+
+class AnalyticsSketch(Base):
+    # Serialized HyperLogLog / top-K state maintained by ingest (see sketches.py)
+    __tablename__ = "analytics_sketch"
+
+    name = Column(String, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime)
+
+
+class CountMinCell(Base):
+    # One non-zero counter of the Count-Min sketch of orders per customer, incremented in place by ingest
+    __tablename__ = "analytics_count_min"
+
+    hash_row = Column(Integer, primary_key=True)
+    bucket = Column(Integer, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
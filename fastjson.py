@@ -0,0 +1,34 @@
+"""JSON responses encoded straight from result rows with orjson.
+
+Returning a Response from a route skips FastAPI's response_model step (building a Pydantic
+model per row, then re-encoding it), which dominates CPU time on large lists. The routes
+keep their response_model, so the OpenAPI schema is unchanged. The rows come from typed
+columns, so they already have the declared shape.
+
+Opt-in with FAST_JSON_ENABLED. orjson is optional: without it the routes go through the
+response_model as before.
+"""
+from typing import List
+
+from fastapi import Response
+
+import config
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+def enabled() -> bool:
+    return config.FAST_JSON_ENABLED and orjson is not None
+
+
+def response(content, headers: dict = None) -> Response:
+    # orjson writes dates as ISO strings and None as null, like the Pydantic path
+    return Response(content=orjson.dumps(content), media_type="application/json", headers=headers)
+
+
+def rows_response(rows, names: List[str], headers: dict = None) -> Response:
+    """List of objects from result rows (tuples in `names` order)."""
+    return response([dict(zip(names, row)) for row in rows], headers)
@@ -0,0 +1,315 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import pandas as pd
+from fastapi import APIRouter, BackgroundTasks, File, HTTPException, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+import metrics
+import partitions
+import rollups
+from cache import cache
+import search_index
+import sketches
+from curd import bulk_create_products, copy_products, upsert_products
+from database import AsyncSessionLocal
+from database_models import IngestWatermark
+
+# CSV headers that differ from the ecommerse_product column names
+COLUMN_MAP = {
+    "total sales": "total_sales",
+    "customer name": "customer_name",
+    "customer location": "customer_location",
+    "payment method": "payment_method",
+}
+
+STRING_COLUMNS = ["name", "category", "customer_name", "customer_location", "payment_method", "status"]
+
+WRITERS = {
+    "insert": bulk_create_products,
+    "copy": copy_products,
+    "upsert": upsert_products,
+}
+
+# "full" inserts every row, "incremental" skips what the source watermark says is loaded and upserts the rest
+INGEST_MODES = "^(full|incremental)$"
+
+# Bytes before the stored offset that must still match for a file to count as "appended to"
+TAIL_HASH_BYTES = 64 * 1024
+
+
+def coerce_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert a raw sales CSV frame into ecommerse_product rows, one column at a time."""
+    df = df.rename(columns=COLUMN_MAP)
+    out = pd.DataFrame(index=df.index)
+    out["id"] = df["id"].astype(str)
+    # "14-03-2025" -> datetime.date
+    out["date"] = pd.to_datetime(df["date"], format="%d-%m-%Y").dt.date
+    out["price"] = df["price"].astype(float)
+    out["quantity"] = df["quantity"].astype(int)
+    out["total_sales"] = df["total_sales"].astype(int)
+    for column in STRING_COLUMNS:
+        out[column] = df[column].astype(object).where(df[column].notna(), None)
+    return out
+
+
+async def ingest_frame(db: AsyncSession, df: pd.DataFrame, batch_size: int = config.INGEST_BATCH_SIZE,
+                       method: str = "insert") -> int:
+    """Write a coerced frame in batches, committing once per batch. Returns the number of rows written.
+
+    The customer rollups and sketches are updated in the same transaction as each batch.
+    """
+    write = WRITERS[method]
+    rows = 0
+    for start in range(0, len(df), batch_size):
+        batch = df.iloc[start:start + batch_size]
+        # loaded_at is left out: the database stamps it (database_models.db_now)
+        records = batch.to_dict("records")
+        await partitions.ensure_for_dates(db, batch["date"].unique())
+        previous = await rollups.fetch_previous(db, list(batch["id"])) if method == "upsert" else None
+        await write(db, records)
+        await rollups.apply_batch(db, batch, previous)
+        await sketches.apply_batch(db, batch, previous)
+        await db.commit()
+        cache.invalidate()
+        search_index.add_frame(batch)
+        rows += len(records)
+    return rows
+
+
+def _tail_hash(handle, offset: int) -> str:
+    start = max(0, offset - TAIL_HASH_BYTES)
+    handle.seek(start)
+    return hashlib.sha256(handle.read(offset - start)).hexdigest()
+
+
+def resume_offset(handle, watermark: Optional[IngestWatermark]) -> int:
+    """Byte offset to resume from when the file is the previously loaded one with rows appended, else 0."""
+    if watermark is None or not watermark.file_offset:
+        return 0
+    size = os.fstat(handle.fileno()).st_size
+    if size < watermark.file_offset or _tail_hash(handle, watermark.file_offset) != watermark.tail_hash:
+        return 0
+    return watermark.file_offset
+
+
+def read_csv_chunks(handle, chunk_rows: int, offset: int = 0):
+    """Chunked CSV reader starting at `offset` (a line boundary past the header)."""
+    handle.seek(0)
+    header = handle.readline()
+    if offset <= len(header):
+        handle.seek(0)
+        return pd.read_csv(handle, chunksize=chunk_rows)
+    names = list(pd.read_csv(io.BytesIO(header), nrows=0).columns)
+    handle.seek(offset)
+    if not handle.peek(1):
+        return iter(())
+    return pd.read_csv(handle, names=names, header=None, chunksize=chunk_rows)
+
+
+# =========================
+# INGEST JOBS
+# =========================
+
+router = APIRouter(prefix="/ingest", tags=["Ingest"], route_class=metrics.TimedRoute)
+
+MAX_JOB_ERRORS = 50
+
+# An upload's file name (or the raw-upload default) doesn't tell two files apart, and a foreign
+# file's rows under another file's date watermark would be skipped without being loaded
+SOURCE_REQUIRED = "Incremental uploads need an explicit source: the watermark is kept per source"
+
+
+class IngestJob(BaseModel):
+    job_id: str
+    source: str
+    mode: str = "full"
+    status: str = "queued"  # queued -> running -> completed | failed
+    bytes_total: int = 0
+    bytes_read: int = 0
+    rows_loaded: int = 0
+    rows_skipped: int = 0
+    rows_failed: int = 0
+    chunks: int = 0
+    rows_per_second: Optional[float] = None
+    progress: float = 0.0
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    errors: List[str] = []
+
+
+# Jobs live in the worker process that accepted the upload
+jobs: Dict[str, IngestJob] = {}
+
+
+def _new_job(source: str, path: str, mode: str) -> IngestJob:
+    job = IngestJob(job_id=uuid.uuid4().hex, source=source, mode=mode, bytes_total=os.path.getsize(path))
+    jobs[job.job_id] = job
+    return job
+
+
+def _record_error(job: IngestJob, message: str):
+    # Driver errors carry the whole statement and parameter list, keep only the first line
+    if len(job.errors) < MAX_JOB_ERRORS:
+        job.errors.append(message.splitlines()[0][:500])
+
+
+async def load_csv(db: AsyncSession, path: str, job: IngestJob, batch_size: int = config.INGEST_BATCH_SIZE,
+                   chunk_rows: int = config.INGEST_CHUNK_ROWS, method: str = "insert"):
+    """Parse `path` in fixed-size chunks and write each one, updating `job` as it goes."""
+    job.status = "running"
+    job.started_at = datetime.now()
+    started = time.perf_counter()
+    incremental = job.mode == "incremental"
+    watermark = await db.get(IngestWatermark, job.source) if incremental else None
+    max_date = watermark.max_date if watermark else None
+    min_date = None
+
+    with open(path, "rb") as handle:
+        offset = resume_offset(handle, watermark) if incremental else 0
+        if incremental and not offset and max_date:
+            # Not a plain append: fall back to the date watermark
+            min_date = max_date - timedelta(days=config.INGEST_LOOKBACK_DAYS)
+        job.bytes_read = offset
+        reader = read_csv_chunks(handle, chunk_rows, offset)
+        first_row = 0
+        while True:
+            # Parsing is CPU bound, keep it off the event loop
+            chunk = await run_in_threadpool(next, reader, None)
+            if chunk is None:
+                break
+            try:
+                frame = await run_in_threadpool(coerce_frame, chunk)
+            except Exception as e:
+                frame = chunk.iloc[0:0]
+                job.rows_failed += len(chunk)
+                _record_error(job, f"rows {first_row}-{first_row + len(chunk) - 1}: {e}")
+            if min_date is not None:
+                keep = frame["date"] >= min_date
+                job.rows_skipped += int((~keep).sum())
+                frame = frame[keep]
+            for start in range(0, len(frame), batch_size):
+                batch = frame.iloc[start:start + batch_size]
+                try:
+                    job.rows_loaded += await ingest_frame(db, batch, batch_size=batch_size,
+                                                          method="upsert" if incremental else method)
+                except Exception as e:
+                    await db.rollback()
+                    job.rows_failed += len(batch)
+                    _record_error(job, f"rows {first_row + start}-{first_row + start + len(batch) - 1}: {e}")
+                    continue
+                batch_max = batch["date"].max()
+                max_date = batch_max if max_date is None else max(max_date, batch_max)
+            first_row += len(chunk)
+            job.chunks += 1
+            job.bytes_read = handle.tell()
+            job.progress = round(job.bytes_read / job.bytes_total, 4) if job.bytes_total else 1.0
+            job.rows_per_second = round(job.rows_loaded / (time.perf_counter() - started), 1)
+
+        # Only move the watermark forward when every row made it in, so a re-run retries failures
+        if incremental and not job.rows_failed:
+            size = os.fstat(handle.fileno()).st_size
+            handle.seek(max(0, size - 1))
+            ends_on_line = handle.read(1) == b"\n"
+            if watermark is None:
+                watermark = IngestWatermark(source=job.source, rows_loaded=0)
+                db.add(watermark)
+            watermark.max_date = max_date
+            watermark.file_offset = size if ends_on_line else 0
+            watermark.tail_hash = _tail_hash(handle, size) if ends_on_line else None
+            watermark.rows_loaded = (watermark.rows_loaded or 0) + job.rows_loaded
+            watermark.updated_at = datetime.now()
+            await db.commit()
+
+    job.status = "completed"
+    job.progress = 1.0
+    job.finished_at = datetime.now()
+    return job
+
+
+async def run_csv_job(job: IngestJob, path: str, batch_size: int, chunk_rows: int, remove_file: bool):
+    try:
+        async with AsyncSessionLocal() as db:
+            await load_csv(db, path, job, batch_size=batch_size, chunk_rows=chunk_rows)
+    except Exception as e:
+        job.status = "failed"
+        job.finished_at = datetime.now()
+        _record_error(job, str(e))
+    finally:
+        if remove_file:
+            os.remove(path)
+
+
+def _spool_path() -> str:
+    fd, path = tempfile.mkstemp(suffix=".csv", dir=config.UPLOAD_DIR)
+    os.close(fd)
+    return path
+
+
+@router.post("/upload", response_model=IngestJob, status_code=202)
+async def upload_csv(background_tasks: BackgroundTasks, file: UploadFile = File(...),
+                     mode: str = Query("full", pattern=INGEST_MODES), source: Optional[str] = None,
+                     batch_size: int = Query(config.INGEST_BATCH_SIZE, ge=1),
+                     chunk_rows: int = Query(config.INGEST_CHUNK_ROWS, ge=1)):
+    if mode == "incremental" and not source:
+        raise HTTPException(status_code=400, detail=SOURCE_REQUIRED)
+    # The multipart file is closed once the response is sent, so keep our own copy on disk
+    path = _spool_path()
+    with open(path, "wb") as out:
+        await run_in_threadpool(shutil.copyfileobj, file.file, out, 1024 * 1024)
+    job = _new_job(source or file.filename or "upload", path, mode)
+    background_tasks.add_task(run_csv_job, job, path, batch_size, chunk_rows, True)
+    return job
+
+
+@router.post("/upload/raw", response_model=IngestJob, status_code=202)
+async def upload_raw_csv(request: Request, background_tasks: BackgroundTasks,
+                         mode: str = Query("full", pattern=INGEST_MODES), source: Optional[str] = None,
+                         batch_size: int = Query(config.INGEST_BATCH_SIZE, ge=1),
+                         chunk_rows: int = Query(config.INGEST_CHUNK_ROWS, ge=1)):
+    if mode == "incremental" and not source:
+        raise HTTPException(status_code=400, detail=SOURCE_REQUIRED)
+    # Stream the body straight to disk instead of holding it in memory
+    path = _spool_path()
+    with open(path, "wb") as out:
+        async for block in request.stream():
+            out.write(block)
+    job = _new_job(source or "raw-upload", path, mode)
+    background_tasks.add_task(run_csv_job, job, path, batch_size, chunk_rows, True)
+    return job
+
+
+@router.post("/server-csv", response_model=IngestJob, status_code=202)
+async def load_server_csv(background_tasks: BackgroundTasks,
+                          mode: str = Query("full", pattern=INGEST_MODES),
+                          batch_size: int = Query(config.INGEST_BATCH_SIZE, ge=1),
+                          chunk_rows: int = Query(config.INGEST_CHUNK_ROWS, ge=1)):
+    path = config.PRODUCTS_CSV_PATH
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"CSV not found: {path}")
+    job = _new_job(path, path, mode)
+    background_tasks.add_task(run_csv_job, job, path, batch_size, chunk_rows, False)
+    return job
+
+
+@router.get("/jobs", response_model=List[IngestJob])
+async def list_jobs():
+    return list(jobs.values())
+
+
+@router.get("/jobs/{job_id}", response_model=IngestJob)
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
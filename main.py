@@ -1,23 +1,39 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Query
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from typing import List
-from datetime import date
-import pandas as pd
+from typing import Optional
+from datetime import date, datetime
+import asyncio
+import os
+import time
 
-from database import engine, Base, get_db
+from database import engine, get_write_db, AsyncSessionLocal
 from database_models import Product
-from curd import create_product, get_products
-from datetime import datetime
+from ingest import INGEST_MODES, IngestJob, load_csv
+import config
+import migrations
+from cache import ResponseCacheMiddleware
+import search_index
+import metrics
 
 app = FastAPI()
+app.router.route_class = metrics.TimedRoute
+# Added first so it is innermost: it times the app itself, not cache hits or compression
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(ResponseCacheMiddleware)
+# Added last so it wraps the cache: cached bodies stay uncompressed and each client gets the encoding it accepts
+app.add_middleware(GZipMiddleware, minimum_size=config.GZIP_MINIMUM_SIZE)
 
 
-# Create tables on startup (async)
+# Apply pending schema migrations on startup (async)
 @app.on_event("startup")
 async def on_startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    await migrations.upgrade(engine)
+    if config.SEARCH_INDEX_ENABLED:
+        # Built in the background; the search routes use SQL until it is ready
+        app.state.search_index_build = asyncio.create_task(search_index.build(AsyncSessionLocal))
 
 
 @app.get("/")
@@ -26,29 +42,31 @@ async def greet():
 
 
 @app.post("/load-products")
-async def load_products(db: AsyncSession = Depends(get_db)):
-    df = pd.read_csv(r"C:\Users\akash\Desktop\amazon_sales_data 2025.csv")
-
-    for _, row in df.iterrows():
-        # Convert string like "14-03-2025" into a proper datetime.date
-        date_obj = datetime.strptime(row["date"], "%d-%m-%Y").date()
-        product_data = {
-            "id": str(row["id"]),  # remove this key if you want auto-increment
-            "date": date_obj,
-            "name": row["name"],
-            "category": row["category"],
-            "price": float(row["price"]),
-            "quantity": int(row["quantity"]),
-            "total_sales": int(row["total sales"]),
-            "customer_name": row["customer name"],
-            "status": row["status"],
-            "customer_location": row["customer location"],
-            "payment_method": row["payment method"],
-        }
-
-        await create_product(db, product_data)
-
-    return {"status": "products loaded"}
+async def load_products(batch_size: int = Query(config.INGEST_BATCH_SIZE, ge=1), use_copy: bool = False,
+                        mode: str = Query("full", pattern=INGEST_MODES),
+                        db: AsyncSession = Depends(get_write_db)):
+    path = config.PRODUCTS_CSV_PATH
+    job = IngestJob(job_id="load-products", source=path, mode=mode, bytes_total=os.path.getsize(path))
+    started = time.perf_counter()
+    await load_csv(db, path, job, batch_size=batch_size, method="copy" if use_copy else "insert")
+    elapsed = time.perf_counter() - started
+
+    if not job.rows_failed:
+        status = "products loaded"
+    else:
+        status = "partial" if job.rows_loaded else "failed"
+    body = {
+        "status": status,
+        "mode": mode,
+        "rows": job.rows_loaded,
+        "rows_skipped": job.rows_skipped,
+        "rows_failed": job.rows_failed,
+        "errors": job.errors,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(job.rows_loaded / elapsed, 1) if elapsed else None,
+    }
+    # Batches that failed are listed in `errors`; a load that wrote nothing is an error response
+    return JSONResponse(body, status_code=500) if status == "failed" else body
 
 
 class ProductOut(BaseModel):
@@ -63,6 +81,7 @@ class ProductOut(BaseModel):
     customer_location: str
     payment_method: str
     status: str
+    loaded_at: Optional[datetime] = None
 
     class Config:
         orm_mode = True
@@ -75,9 +94,14 @@ class ProductOut(BaseModel):
 
 
 
-import product,customer
+import product,customer,ingest,analytics,cache,slow_queries
 app.include_router(customer.router)
 app.include_router(product.router)
+app.include_router(ingest.router)
+app.include_router(analytics.router)
+app.include_router(cache.router)
+app.include_router(metrics.router)
+app.include_router(slow_queries.router)
 # app.include_router(user.router)
 
 
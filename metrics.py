@@ -0,0 +1,255 @@
+"""Request and SQL instrumentation, exposed in Prometheus text format at GET /metrics.
+
+MetricsMiddleware (pure ASGI) times each request, and engine cursor hooks add the SQL time,
+statement count and rows returned to the request being served (found through a ContextVar).
+Route endpoints are wrapped by TimedRoute so the time after the endpoint returns — response
+model validation and JSON encoding — can be told apart from the handler itself. Per route:
+
+    sql        time inside cursor.execute (including fetching the buffered result)
+    handler    the rest of the endpoint: ORM/row hydration, Python work, building the response
+    serialize  endpoint return -> response start: response_model validation and JSON encoding
+    send       response start -> last body chunk (streaming responses)
+
+Histograms are fixed-bucket counters, so recording is a few list increments per request.
+The middleware sits inside the response cache: cache hits are counted by /cache/stats.
+"""
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+
+from fastapi import APIRouter, Response
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+import config
+import database
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+PHASES = ("sql", "handler", "serialize", "send")
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def lines(self, name: str, labels: str) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        cumulative += self.counts[-1]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class RouteMetrics:
+    __slots__ = ("latency", "phases", "queries", "rows", "statuses")
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.phases = {phase: Histogram(LATENCY_BUCKETS) for phase in PHASES}
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.rows = Histogram(ROW_BUCKETS)
+        self.statuses = {}
+
+
+class RequestStats:
+    """What one request has spent so far; filled in by the engine hooks and TimedRoute."""
+    __slots__ = ("path", "sql", "queries", "rows", "handler_done")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sql = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.handler_done = None
+
+
+# (method, route template) -> RouteMetrics
+routes = {}
+current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not config.METRICS_ENABLED or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(scope["path"])
+        token = current.set(stats)
+        start = time.perf_counter()
+        status = 500
+        response_started = None
+
+        async def timed_send(message):
+            nonlocal status, response_started
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_started = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            end = time.perf_counter()
+            current.reset(token)
+            route = scope.get("route")
+            # Unmatched paths share one label so 404 scans can't blow up the series count
+            key = (scope["method"], route.path if route is not None else "<unmatched>")
+            metrics = routes.get(key)
+            if metrics is None:
+                metrics = routes[key] = RouteMetrics()
+            metrics.latency.observe(end - start)
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            metrics.queries.observe(stats.queries)
+            metrics.rows.observe(stats.rows)
+
+            response_started = response_started or end
+            handler_done = stats.handler_done or response_started
+            phases = metrics.phases
+            phases["sql"].observe(stats.sql)
+            phases["handler"].observe(max(handler_done - start - stats.sql, 0.0))
+            phases["serialize"].observe(max(response_started - handler_done, 0.0))
+            phases["send"].observe(end - response_started)
+
+
+class TimedRoute(APIRoute):
+    """APIRoute that records when the endpoint returns (before FastAPI serializes the result)."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            original = endpoint
+
+            @functools.wraps(original)
+            async def endpoint(*args, **kw):
+                result = await original(*args, **kw)
+                stats = current.get()
+                if stats is not None:
+                    stats.handler_done = time.perf_counter()
+                return result
+
+        super().__init__(path, endpoint, **kwargs)
+
+
+# Called as listener(conn, statement, parameters, executemany, seconds) after every statement on an
+# instrumented engine, so other consumers (the slow-query log) share this one timing hook
+statement_listeners = []
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("statement_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    stats = current.get()
+    if stats is not None:
+        stats.sql += elapsed
+        stats.queries += 1
+        if cursor.description is not None:
+            # The async adapters buffer non-streaming results at execute time; server-side cursors count 0
+            buffered = getattr(cursor, "_rows", None)
+            stats.rows += len(buffered) if buffered is not None else max(cursor.rowcount, 0)
+    for listener in statement_listeners:
+        listener(conn, statement, parameters, executemany, elapsed)
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute doesn't fire for a failed statement: drop its start time so the
+    # next statement on this pooled connection isn't timed from it
+    conn = exception_context.connection
+    started = conn.info.get("statement_started") if conn is not None else None
+    if started:
+        started.pop()
+
+
+def instrument(engine):
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", _handle_error)
+
+
+for _engine in database.engines.values():
+    instrument(_engine)
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+
+def render() -> str:
+    lines = [
+        "# HELP http_requests_total Requests served, by route and status.",
+        "# TYPE http_requests_total counter",
+    ]
+    for (method, path), metrics in routes.items():
+        for status, count in metrics.statuses.items():
+            lines.append(f"http_requests_total{{{_labels(method=method, route=path, status=status)}}} {count}")
+
+    families = [
+        ("http_request_duration_seconds", "histogram", "Request latency inside the response cache.",
+         lambda metrics: [({}, metrics.latency)]),
+        ("http_request_phase_seconds", "histogram", "Request time by phase: sql, handler, serialize, send.",
+         lambda metrics: [({"phase": phase}, histogram) for phase, histogram in metrics.phases.items()]),
+        ("db_queries_per_request", "histogram", "SQL statements executed per request.",
+         lambda metrics: [({}, metrics.queries)]),
+        ("db_rows_per_request", "histogram", "Rows returned by SQL per request.",
+         lambda metrics: [({}, metrics.rows)]),
+    ]
+    for name, kind, help_text, series in families:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for (method, path), metrics in routes.items():
+            for extra, histogram in series(metrics):
+                lines += histogram.lines(name, _labels(method=method, route=path, **extra))
+
+    gauges = [("db_pool_checked_out", "checked_out", "Connections in use."),
+              ("db_pool_idle", "idle", "Idle connections in the pool."),
+              ("db_pool_checkout_failures_total", "checkout_failures", "Failed connection checkouts."),
+              ("db_pool_checkout_wait_seconds_total", "wait_seconds_total", "Time spent waiting for connections.")]
+    pools = {name: database.pool_status(engine) for name, engine in database.engines.items()}
+    for name, field, help_text in gauges:
+        lines += [f"# HELP {name} {help_text}",
+                  f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}"]
+        lines += [f"{name}{{{_labels(pool=pool)}}} {status[field]}" for pool, status in pools.items()
+                  if field in status]
+    return "\n".join(lines) + "\n"
+
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+
+@router.get("", response_class=Response)
+async def prometheus_metrics():
+    """Route latency / phase / query histograms and pool gauges in Prometheus text format."""
+    return Response(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get("/pool")
+async def pool_metrics():
+    """Connection pool state and checkout counters, per engine (primary and replicas)."""
+    status = {name: database.pool_status(engine) for name, engine in database.engines.items()}
+    for replica in database.replicas.replicas:
+        status[replica.name]["healthy"] = replica.healthy
+    return status
@@ -0,0 +1,265 @@
+"""Versioned schema migrations for the analytics database.
+
+Each migration runs once, in version order, and is recorded in `schema_migrations`.
+Migrations are plain functions taking a sync Connection (they run through
+`conn.run_sync`), so they can use both SQLAlchemy DDL objects and raw SQL.
+
+    python migrations.py upgrade   # apply pending migrations
+    python migrations.py status    # list applied / pending versions
+    python migrations.py check     # EXPLAIN each route query and verify it uses its index
+"""
+import asyncio
+import sys
+from datetime import date, datetime
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import inspect, select, text, update
+
+import config
+import curd
+import partitions
+import rollups
+import sketches
+from database import engine
+from database_models import (AnalyticsSketch, CountMinCell, CustomerLocationMember, CustomerLocationRollup,
+                             CustomerNameRollup, IngestWatermark, PG_TRGM, PG_WRITE_CLOCK, Product,
+                             SchemaMigration, db_now)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    upgrade: Callable
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str):
+    def register(upgrade):
+        MIGRATIONS.append(Migration(version, description, upgrade))
+        return upgrade
+    return register
+
+
+def _create_indexes(conn, table, names):
+    indexes = {index.name: index for index in table.indexes}
+    for name in names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+@migration(1, "baseline: ecommerse_product, ingest_watermark, keyset and trigram indexes")
+def baseline(conn):
+    PG_TRGM(Product.__table__, conn)
+    for table in (Product.__table__, IngestWatermark.__table__):
+        table.create(conn, checkfirst=True)
+    _create_indexes(conn, Product.__table__, [
+        "ix_ecommerse_product_date_id",
+        "ix_ecommerse_product_name_trgm",
+        "ix_ecommerse_product_category_trgm",
+    ])
+
+
+@migration(2, "B-tree indexes for the price, date and customer GROUP BY routes")
+def analytic_indexes(conn):
+    _create_indexes(conn, Product.__table__, [
+        "ix_ecommerse_product_price_name_category",
+        "ix_ecommerse_product_location_customer",
+        "ix_ecommerse_product_customer_id",
+    ])
+
+
+@migration(3, "customer rollup tables, backfilled from ecommerse_product")
+def customer_rollups(conn):
+    for table in (CustomerLocationRollup.__table__, CustomerNameRollup.__table__, CustomerLocationMember.__table__):
+        table.create(conn, checkfirst=True)
+    rollups.rebuild(conn)
+
+
+@migration(4, "ecommerse_product.loaded_at for delta sync, backfilled with the migration time")
+def product_loaded_at(conn):
+    # Tables created by the baseline on a fresh database already have the column
+    if "loaded_at" not in {column["name"] for column in inspect(conn).get_columns(Product.__tablename__)}:
+        column_type = Product.__table__.c.loaded_at.type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {Product.__tablename__} ADD COLUMN loaded_at {column_type}"))
+    conn.execute(update(Product.__table__).where(Product.loaded_at.is_(None)).values(loaded_at=datetime.now()))
+    _create_indexes(conn, Product.__table__, ["ix_ecommerse_product_loaded_at_id"])
+
+
+@migration(5, "analytics_sketch table")
+def analytics_sketches(conn):
+    # Built by migration 8, once the Count-Min counters have their own table
+    AnalyticsSketch.__table__.create(conn, checkfirst=True)
+
+
+@migration(6, "ecommerse_product.loaded_at stamped by the database clock")
+def product_loaded_at_default(conn):
+    table = Product.__tablename__
+    if conn.dialect.name == "postgresql":
+        # COPY leaves loaded_at to the column default; SQLite tables keep theirs (no ALTER ... SET DEFAULT)
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN loaded_at SET DEFAULT now()"))
+    # Rows stamped by the application clock ahead of the database clock would hide newer rows
+    # from delta sync; restamp them with the database time
+    conn.execute(update(Product.__table__).where(Product.loaded_at > db_now()).values(loaded_at=db_now()))
+
+
+@migration(7, "ecommerse_product.loaded_at stamped at write time, after the writer takes its xid")
+def product_loaded_at_write_clock(conn):
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"ALTER TABLE {Product.__tablename__} ALTER COLUMN loaded_at SET DEFAULT {PG_WRITE_CLOCK}"))
+
+
+@migration(8, "analytics_count_min counters; sketches rebuilt from ecommerse_product when SKETCHES_ENABLED")
+def count_min_cells(conn):
+    CountMinCell.__table__.create(conn, checkfirst=True)
+    # Also moves sketches built before this version off the single Count-Min blob
+    built = conn.execute(select(AnalyticsSketch.name).where(AnalyticsSketch.name == sketches.CUSTOMERS)).first()
+    if config.SKETCHES_ENABLED or built is not None:
+        sketches.rebuild(conn)
+
+
+def _lock(conn):
+    # Several workers may start at once; only one of them migrates at a time
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(7461001)"))
+
+
+def _upgrade(conn) -> List[int]:
+    _lock(conn)
+    SchemaMigration.__table__.create(conn, checkfirst=True)
+    applied = set(conn.execute(select(SchemaMigration.version)).scalars())
+    done = []
+    for step in sorted(MIGRATIONS, key=lambda m: m.version):
+        if step.version in applied:
+            continue
+        step.upgrade(conn)
+        conn.execute(SchemaMigration.__table__.insert().values(
+            version=step.version, description=step.description, applied_at=datetime.now()))
+        done.append(step.version)
+    # Opt-in monthly partitioning (PostgreSQL): converts the table once, then adds upcoming months
+    partitions.ensure(conn)
+    return done
+
+
+async def upgrade(bind=engine) -> List[int]:
+    """Apply pending migrations in one transaction. Returns the versions applied."""
+    async with bind.begin() as conn:
+        return await conn.run_sync(_upgrade)
+
+
+async def status(bind=engine) -> List[dict]:
+    async with bind.begin() as conn:
+        await conn.run_sync(SchemaMigration.__table__.create, checkfirst=True)
+        result = await conn.execute(select(SchemaMigration.version, SchemaMigration.applied_at))
+        applied = {row.version: row.applied_at for row in result}
+    return [{"version": step.version, "description": step.description, "applied_at": applied.get(step.version)}
+            for step in sorted(MIGRATIONS, key=lambda m: m.version)]
+
+
+# =========================
+# INDEX USAGE CHECK
+# =========================
+
+def index_checks(dialect_name: str) -> list:
+    """(route, statement, index the plan should use) for the query shapes the indexes were built for."""
+    checks = [
+        ("GET /products/ (keyset page)", curd.get_products_page_query(100, (date(2025, 1, 1), "")),
+         "ix_ecommerse_product_date_id"),
+        ("GET /products/recent", curd.recent_products_query(50), "ix_ecommerse_product_date_id"),
+        ("GET /products/query (date range, sort=date)",
+         curd.product_query(curd.product_filters(from_date=date(2025, 1, 1), to_date=date(2025, 1, 31)),
+                            "date", 100), "ix_ecommerse_product_date_id"),
+        ("GET /products/changes", curd.product_changes_query(1000, datetime(2025, 1, 1)),
+         "ix_ecommerse_product_loaded_at_id"),
+        ("GET /products/filter/{from_date}/{to_date}",
+         curd.products_between_dates_query(date(2025, 1, 1), date(2025, 1, 31)), "ix_ecommerse_product_date_id"),
+        ("GET /products/filter/price/{max_price}/{min_price}", curd.products_by_price_query(100, 200),
+         "ix_ecommerse_product_price_name_category"),
+        ("GET /analytics/timeseries (date range)",
+         curd.revenue_timeseries_query("week", dialect_name, None, date(2025, 1, 1), date(2025, 1, 31)),
+         "ix_ecommerse_product_date_id"),
+        ("GET /customer/user", curd.customers_by_location_query(), "ix_ecommerse_product_location_customer"),
+        ("GET /customer/mostorder", curd.orders_by_customer_query(), "ix_ecommerse_product_customer_id"),
+    ]
+    if dialect_name == "postgresql":
+        # LIKE '%word%' can only use the trigram GIN indexes
+        checks += [
+            ("GET /products/search/{keyword}", curd.search_products_query(Product.name, "phone", dialect_name),
+             "ix_ecommerse_product_name_trgm"),
+            ("GET /products/filter/{word}", curd.search_products_query(Product.category, "elec", dialect_name),
+             "ix_ecommerse_product_category_trgm"),
+        ]
+    return checks
+
+
+def _explain(conn, statement) -> str:
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    rows = conn.exec_driver_sql(prefix + sql).all()
+    return "\n".join(str(row[-1]) for row in rows)
+
+
+def _partition_indexes(conn) -> dict:
+    # On a partitioned table the plan names each partition's copy of an index
+    if conn.dialect.name != "postgresql":
+        return {}
+    rows = conn.execute(text(
+        "SELECT parent.relname, child.relname FROM pg_inherits i "
+        "JOIN pg_class parent ON parent.oid = i.inhparent JOIN pg_class child ON child.oid = i.inhrelid "
+        "WHERE parent.relkind = 'I'"))
+    children = {}
+    for parent, child in rows:
+        children.setdefault(parent, []).append(child)
+    return children
+
+
+def _check(conn) -> List[dict]:
+    if conn.dialect.name == "postgresql":
+        # On small tables a sequential scan is cheaper; this checks that the index *can* serve the query
+        conn.execute(text("SET LOCAL enable_seqscan = off"))
+    children = _partition_indexes(conn)
+    results = []
+    for route, statement, index_name in index_checks(conn.dialect.name):
+        plan = _explain(conn, statement)
+        uses_index = any(name in plan for name in [index_name, *children.get(index_name, [])])
+        results.append({"route": route, "index": index_name, "uses_index": uses_index, "plan": plan})
+    return results
+
+
+async def check(bind=engine) -> List[dict]:
+    """EXPLAIN every checked route query; nothing is changed (the transaction is rolled back)."""
+    async with bind.connect() as conn:
+        results = await conn.run_sync(_check)
+        await conn.rollback()
+    return results
+
+
+async def _main(command: str) -> int:
+    try:
+        return await _run(command)
+    finally:
+        await engine.dispose()
+
+
+async def _run(command: str) -> int:
+    if command == "upgrade":
+        print("applied:", await upgrade() or "nothing to do")
+    elif command == "status":
+        for row in await status():
+            print(f"{row['version']:>4}  {'applied ' + str(row['applied_at']) if row['applied_at'] else 'pending'}"
+                  f"  {row['description']}")
+    elif command == "check":
+        results = await check()
+        for row in results:
+            print(f"{'OK  ' if row['uses_index'] else 'FAIL'}  {row['route']}  ->  {row['index']}")
+            if not row["uses_index"]:
+                print("      " + row["plan"].replace("\n", "\n      "))
+        return 0 if all(row["uses_index"] for row in results) else 1
+    else:
+        print(__doc__)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "")))
@@ -0,0 +1,230 @@
+"""Monthly range partitioning of ecommerse_product by `date` (PostgreSQL, PRODUCT_PARTITIONING=true).
+
+The model declares the table `PARTITION BY RANGE (date)` with (id, date) as primary key. Each
+month lives in `ecommerse_product_YYYY_MM`; rows outside every month partition go to
+`ecommerse_product_default`, and are moved out when their month's partition is created.
+
+    python partitions.py ensure            # convert the table if needed, create partitions up to N months ahead
+    python partitions.py detach 2024-01    # detach partitions of months before 2024-01 (kept as plain tables)
+    python partitions.py drop 2024-01      # detach and drop them
+    python partitions.py check             # EXPLAIN a one-month date filter and verify partition pruning
+
+Migrations call ensure() on every upgrade, so startup creates upcoming months; ingest creates
+the months of each batch before writing it.
+"""
+import asyncio
+import sys
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+import config
+import curd
+import rollups
+import sketches
+from database import engine
+from database_models import Product
+
+TABLE = Product.__tablename__
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+# Month partitions known to exist (committed) in this process, so ingest only checks new months once
+_known = set()
+# Session.info key of the partitions an ingest transaction created or checked; they join _known on commit
+PENDING_KEY = "pending_partitions"
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_pending(session):
+    _known.update(session.info.pop(PENDING_KEY, ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_pending(session):
+    # A rolled-back batch also undid its CREATE/ATTACH; the next batch checks the month again
+    session.info.pop(PENDING_KEY, None)
+
+
+def enabled(conn) -> bool:
+    return config.PRODUCT_PARTITIONING and conn.dialect.name == "postgresql"
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def months_between(first: date, last: date) -> List[date]:
+    months = []
+    month = month_start(first)
+    while month <= last:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def partition_name(month: date) -> str:
+    return f"{TABLE}_{month:%Y_%m}"
+
+
+def is_partitioned(conn) -> bool:
+    return conn.execute(text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name)"),
+                        {"name": TABLE}).first() is not None
+
+
+def partitions(conn) -> List[str]:
+    """Names of the attached partitions."""
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:name) ORDER BY c.relname"), {"name": TABLE})
+    return [row[0] for row in rows]
+
+
+def ensure_default(conn):
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT"))
+
+
+def create_partition(conn, month: date) -> str:
+    """Create and attach the partition of `month`, moving its rows out of the default partition.
+
+    The caller records the name in _known once the transaction has committed.
+    """
+    name = partition_name(month)
+    if name in _known:
+        return name
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is None:
+        bounds = {"start": month, "end": next_month(month)}
+        conn.execute(text(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        conn.execute(text(f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} "
+                          "WHERE date >= :start AND date < :end"), bounds)
+        conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE date >= :start AND date < :end"), bounds)
+        # Attaching builds the partition's copies of the table's indexes
+        conn.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+                          f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"))
+    return name
+
+
+def ensure_months(conn, first: date, last: date):
+    for month in months_between(first, last):
+        create_partition(conn, month)
+
+
+def convert(conn):
+    """Rebuild a plain ecommerse_product as the partitioned table declared by the model."""
+    old = f"{TABLE}_unpartitioned"
+    conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {old}"))
+    # Index and constraint names are schema-wide; the new table recreates them
+    for index in Product.__table__.indexes:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    conn.execute(text(f"ALTER TABLE {old} DROP CONSTRAINT IF EXISTS {TABLE}_pkey"))
+    Product.__table__.create(conn)
+    ensure_default(conn)
+    first, last = conn.execute(text(f"SELECT min(date), max(date) FROM {old}")).one()
+    if first is not None:
+        ensure_months(conn, first, last)
+    columns = ", ".join(column.name for column in Product.__table__.columns)
+    conn.execute(text(f"INSERT INTO {TABLE} ({columns}) SELECT {columns} FROM {old}"))
+    conn.execute(text(f"DROP TABLE {old}"))
+
+
+def ensure(conn, today: Optional[date] = None):
+    """Partition the table if it isn't yet, then create partitions through PARTITION_MONTHS_AHEAD."""
+    if not enabled(conn):
+        return
+    if not is_partitioned(conn):
+        convert(conn)
+    # A table created partitioned by the baseline migration has no default partition yet
+    ensure_default(conn)
+    today = today or date.today()
+    last = today
+    for _ in range(config.PARTITION_MONTHS_AHEAD):
+        last = next_month(last)
+    ensure_months(conn, month_start(today), last)
+
+
+async def ensure_for_dates(db, dates):
+    """Create the month partitions an ingest batch writes to (call before the batch is written)."""
+    conn = await db.connection()
+    if not enabled(conn):
+        return
+    months = {month_start(day) for day in dates if day is not None}
+    missing = sorted(month for month in months if partition_name(month) not in _known)
+    if missing:
+        names = await conn.run_sync(lambda sync_conn: [create_partition(sync_conn, month) for month in missing])
+        db.info.setdefault(PENDING_KEY, set()).update(names)
+
+
+def detach_before(conn, cutoff: date, drop: bool = False) -> List[str]:
+    """Detach (and optionally drop) the month partitions entirely before `cutoff`.
+
+    Detached partitions stay as plain tables, to be archived or dumped; the customer rollups
+    (and sketches) are rebuilt since their rows left the fact table.
+    """
+    detached = []
+    for name in partitions(conn):
+        if name == DEFAULT_PARTITION:
+            continue
+        year, month = name[len(TABLE) + 1:].split("_")
+        if next_month(date(int(year), int(month), 1)) > cutoff:
+            continue
+        conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+        if drop:
+            conn.execute(text(f"DROP TABLE {name}"))
+        _known.discard(name)
+        detached.append(name)
+    if detached:
+        rollups.rebuild(conn)
+        if config.SKETCHES_ENABLED:
+            sketches.rebuild(conn)
+    return detached
+
+
+def check_pruning(conn, month: Optional[date] = None) -> dict:
+    """EXPLAIN the date-range route for one month and report which partitions the plan reads."""
+    month = month or month_start(date.today())
+    last = date.fromordinal(next_month(month).toordinal() - 1)
+    statement = curd.products_between_dates_query(month, last)
+    sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+    plan = "\n".join(row[0] for row in conn.exec_driver_sql("EXPLAIN " + sql))
+    attached = partitions(conn)
+    scanned = [name for name in attached if name in plan]
+    expected = partition_name(month)
+    return {"month": month.isoformat(), "expected": expected, "scanned": scanned,
+            "pruned": scanned == [expected] or (not scanned and expected not in attached), "plan": plan}
+
+
+async def _run(command: str, argument: Optional[str]) -> int:
+    async with engine.begin() as conn:
+        if command == "ensure":
+            await conn.run_sync(ensure)
+            print("partitions:", ", ".join(await conn.run_sync(partitions)))
+        elif command in ("detach", "drop") and argument:
+            cutoff = date.fromisoformat(argument + "-01")
+            detached = await conn.run_sync(lambda sync_conn: detach_before(sync_conn, cutoff, command == "drop"))
+            print("dropped:" if command == "drop" else "detached:", ", ".join(detached) or "nothing")
+        elif command == "check":
+            result = await conn.run_sync(check_pruning)
+            print(f"{'OK  ' if result['pruned'] else 'FAIL'}  {result['month']}  scans {result['scanned']}")
+            if not result["pruned"]:
+                print("      " + result["plan"].replace("\n", "\n      "))
+            return 0 if result["pruned"] else 1
+        else:
+            print(__doc__)
+            return 2
+    return 0
+
+
+async def _main(command: str, argument: Optional[str]) -> int:
+    try:
+        return await _run(command, argument)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "", sys.argv[2] if len(sys.argv) > 2 else None)))
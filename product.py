@@ -1,47 +1,246 @@
-from fastapi import APIRouter,Depends
+from fastapi import APIRouter,Depends,HTTPException,Query,Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_db
-import main
-from typing import List
+from database import get_read_db, get_write_db
+import main,curd,config,search_index,columnar,fastjson,metrics
+from typing import List, Optional
+import base64
+import json
+from datetime import date as date_type, datetime as datetime_type
+from pydantic import BaseModel
 
-router = APIRouter(prefix="/products", tags=['Products'])
-@router.get("/",response_model=List[main.ProductOut])
-async def get_all_product(db:AsyncSession=Depends(get_db)):
-    result = await main.get_products(db)
-    return  result
+router = APIRouter(prefix="/products", tags=['Products'], route_class=metrics.TimedRoute)
 
+PRODUCT_COLUMNS = {column.name: column for column in main.Product.__table__.columns}
+PRODUCT_ARROW_TYPES = {name: columnar.arrow_type(column.type)
+                       for name, column in PRODUCT_COLUMNS.items()} if columnar.pa else {}
+
+
+class ProductFields(BaseModel):
+    # Same fields as ProductOut, but any of them may be left out by a `fields=` projection
+    id: Optional[str] = None
+    date: Optional[date_type] = None
+    name: Optional[str] = None
+    category: Optional[str] = None
+    price: Optional[float] = None
+    quantity: Optional[int] = None
+    total_sales: Optional[int] = None
+    customer_name: Optional[str] = None
+    customer_location: Optional[str] = None
+    payment_method: Optional[str] = None
+    status: Optional[str] = None
+    loaded_at: Optional[datetime_type] = None
+
+
+class ProductPage(BaseModel):
+    items: List[ProductFields]
+    next_cursor: Optional[str] = None
+
+
+class ProductQueryPage(BaseModel):
+    items: List[ProductFields]
+    next_offset: Optional[int] = None
+    # Only with count=exact|estimate
+    total: Optional[int] = None
+    total_is_estimate: Optional[bool] = None
+
+
+SORT_PATTERN = f"^({'|'.join(curd.PRODUCT_SORTS)})$"
+
+
+class ProductVersion(BaseModel):
+    # Latest loaded_at; changes only when ingest writes new or changed rows
+    version: Optional[datetime_type] = None
+
+
+def encode_cursor(row_date, row_id) -> str:
+    raw = json.dumps([row_date.isoformat() if row_date else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str, parse=date_type.fromisoformat) -> tuple:
+    try:
+        row_key, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return parse(row_key), row_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def encoded_response(request:Request, rows, names:List[str], keep:List[str]=None, headers:dict=None):
+    """Arrow / Parquet response when the client asked for one, an orjson-encoded one on the
+    fast JSON path, else None (the route returns the rows through its response_model).
+
+    `names` are the columns of `rows`; `keep` optionally narrows the columnar output.
+    """
+    media_type = columnar.negotiate(request)
+    if media_type is not None:
+        table = columnar.rows_to_table(rows, names, PRODUCT_ARROW_TYPES)
+        if keep is not None:
+            table = table.select(keep)
+        return columnar.table_response(table, media_type, headers)
+    if fastjson.enabled():
+        return fastjson.rows_response(rows, names, headers)
+    return None
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    if not fields:
+        return list(PRODUCT_COLUMNS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in PRODUCT_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+
+@router.get("/",response_model=ProductPage,response_model_exclude_unset=True)
+async def get_all_product(request:Request,limit:int=Query(100,ge=1,le=config.PRODUCTS_MAX_PAGE_SIZE),
+                          cursor:Optional[str]=None,fields:Optional[str]=None,
+                          db:AsyncSession=Depends(get_read_db)):
+    names = parse_fields(fields)
+    after = decode_cursor(cursor) if cursor else None
+    # date and id are always selected because the next cursor is built from them
+    selected = list(dict.fromkeys(names + ["date", "id"]))
+    rows = await curd.get_products_page(db, limit + 1, after, [PRODUCT_COLUMNS[name] for name in selected])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].date, rows[-1].id)
+
+    # Columnar clients get the cursor in a header instead of the envelope
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    if columnar.negotiate(request) is not None:
+        return encoded_response(request, rows, selected, keep=names, headers=headers)
+    items = [{name: row._mapping[name] for name in names} for row in rows]
+    if fastjson.enabled():
+        return fastjson.response({"items": items, "next_cursor": next_cursor})
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@router.get("/query",response_model=ProductQueryPage,response_model_exclude_unset=True)
+async def query_products(request:Request,category:Optional[str]=None,name:Optional[str]=None,
+                         from_date:Optional[date_type]=None,to_date:Optional[date_type]=None,
+                         min_price:Optional[float]=None,max_price:Optional[float]=None,
+                         status:Optional[str]=None,payment_method:Optional[str]=None,location:Optional[str]=None,
+                         sort:str=Query("date",pattern=SORT_PATTERN),fields:Optional[str]=None,
+                         limit:int=Query(100,ge=1,le=config.PRODUCTS_MAX_PAGE_SIZE),offset:int=Query(0,ge=0),
+                         count:str=Query("none",pattern="^(none|exact|estimate)$"),
+                         db:AsyncSession=Depends(get_read_db)):
+    """Every filter is optional; the ones given are ANDed into a single statement.
+
+    category/name are substring matches, status/payment_method/location exact ones.
+    count=exact adds COUNT(*) over the same filters; count=estimate reads the planner's row
+    estimate instead on PostgreSQL (an exact count elsewhere).
+    """
+    if from_date and to_date and from_date > to_date:
+        raise HTTPException(status_code=400, detail="from_date is after to_date")
+    if min_price is not None and max_price is not None and min_price > max_price:
+        raise HTTPException(status_code=400, detail="min_price is above max_price")
+    names = parse_fields(fields)
+    conditions = curd.product_filters(category, name, from_date, to_date, min_price, max_price,
+                                      status, payment_method, location)
+    query = curd.product_query(conditions, sort, limit + 1, offset, [PRODUCT_COLUMNS[name] for name in names])
+    rows = (await db.execute(query)).all()
+
+    page = {"next_offset": None}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        page["next_offset"] = offset + limit
+    if count != "none":
+        conn = await db.connection()
+        if count == "estimate" and conn.dialect.name == "postgresql":
+            page.update(total=await curd.estimate_count(db, conditions), total_is_estimate=True)
+        else:
+            total = (await db.execute(curd.product_count_query(conditions))).scalar()
+            page.update(total=total, total_is_estimate=False)
+
+    if columnar.negotiate(request) is not None:
+        # Columnar clients get the page metadata in headers
+        headers = {f"X-{key.replace('_', '-').title()}": str(value) for key, value in page.items()
+                   if value is not None}
+        return encoded_response(request, rows, names, headers=headers)
+    page["items"] = [dict(zip(names, row)) for row in rows]
+    if fastjson.enabled():
+        return fastjson.response(page)
+    return page
+
+
+# The sync routes read the primary: a replica behind the one serving /version would skip rows
+@router.get("/version",response_model=ProductVersion)
+async def product_version(db:AsyncSession=Depends(get_write_db)):
+    """Data version for delta sync: pass it as `since` to /products/changes."""
+    conn = await db.connection()
+    result = await db.execute(curd.product_version_query(curd.change_horizon(conn.dialect.name)))
+    return {"version": result.scalar()}
+
+
+@router.get("/changes",response_model=ProductPage)
+async def product_changes(request:Request,since:Optional[datetime_type]=None,cursor:Optional[str]=None,
+                          limit:int=Query(1000,ge=1,le=config.CHANGES_MAX_PAGE_SIZE),
+                          db:AsyncSession=Depends(get_write_db)):
+    """Products written by ingest after `since` (all of them without it), in (loaded_at, id) order.
+
+    Follow next_cursor until it is null; the last row's loaded_at is the version reached. Rows of
+    transactions that may still be joined by earlier-stamped commits are held back (see
+    curd.change_horizon), so resuming from the version reached never skips a row.
+    """
+    after = decode_cursor(cursor, parse=datetime_type.fromisoformat) if cursor else None
+    conn = await db.connection()
+    horizon = curd.change_horizon(conn.dialect.name)
+    result = await db.execute(curd.product_changes_query(limit + 1, since, after, horizon))
+    rows = result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].loaded_at, rows[-1].id)
+
+    names = list(PRODUCT_COLUMNS)
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    if columnar.negotiate(request) is not None:
+        return encoded_response(request, rows, names, headers=headers)
+    items = [dict(zip(names, row)) for row in rows]
+    if fastjson.enabled():
+        return fastjson.response({"items": items, "next_cursor": next_cursor})
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@router.get("/recent",response_model=List[main.ProductOut])
+async def recent_products(request:Request,limit:int=Query(50,ge=1,le=config.PRODUCTS_MAX_PAGE_SIZE),
+                          db:AsyncSession=Depends(get_read_db)):
+    """The newest `limit` orders, by date then id."""
+    result = await db.execute(curd.recent_products_query(limit))
+    rows = result.all()
+    response = encoded_response(request, rows, list(PRODUCT_COLUMNS))
+    return rows if response is None else response
 
-@router.get("/filter/{word}",response_model=List[main.ProductOut])
-async def filter_by_category_with_keyword(word:str,db:AsyncSession=Depends(get_db)):
-    results=[]
-    products = await main.get_products(db)
-    for product in products:
-        if word.lower() in product.category.lower():
-            results.append(product)
-    return results
 
 @router.get("/filter/{word}",response_model=List[main.ProductOut])
-async def filter_by_category_with_keyword(word:str,db:AsyncSession=Depends(get_db)):
-    results=[]
-    products = await main.get_products(db)
-    for product in products:
-        if word.lower() in product.category.lower():
-            results.append(product)
-    return results
+async def filter_by_category_with_keyword(request:Request,word:str,limit:int=Query(100,ge=1,le=config.SEARCH_MAX_PAGE_SIZE),
+                                          offset:int=Query(0,ge=0),db:AsyncSession=Depends(get_read_db)):
+    ids = search_index.index.search("category", word, limit, offset) if config.SEARCH_INDEX_ENABLED else None
+    if ids is not None:
+        rows = await curd.get_products_by_ids(db, ids)
+    else:
+        rows = await curd.search_products(db, main.Product.category, word, limit, offset)
+    response = encoded_response(request, rows, list(PRODUCT_COLUMNS))
+    return rows if response is None else response
 
 @router.get("/search/{product_keyword}",response_model=List[main.ProductOut])
-async def search_by_product_keyword(product_keyword:str,db:AsyncSession=Depends(get_db)):
-    results = []
-    products = await main.get_products(db)
-    for product in products:
-        if product_keyword.lower() in product.name.lower():
-            results.append(product)
-    return results
+async def search_by_product_keyword(request:Request,product_keyword:str,limit:int=Query(100,ge=1,le=config.SEARCH_MAX_PAGE_SIZE),
+                                    offset:int=Query(0,ge=0),db:AsyncSession=Depends(get_read_db)):
+    ids = search_index.index.search("name", product_keyword, limit, offset) if config.SEARCH_INDEX_ENABLED else None
+    if ids is not None:
+        rows = await curd.get_products_by_ids(db, ids)
+    else:
+        rows = await curd.search_products(db, main.Product.name, product_keyword, limit, offset)
+    response = encoded_response(request, rows, list(PRODUCT_COLUMNS))
+    return rows if response is None else response
 
 from sqlalchemy.future import select
 from datetime import datetime
 @router.get("/filter/{from_date}/{to_date}",response_model=List[main.ProductOut])
-async def filter_product_by_dates(from_date:str,to_date:str,db:AsyncSession=Depends(get_db)):
+async def filter_product_by_dates(request:Request,from_date:str,to_date:str,db:AsyncSession=Depends(get_read_db)):
     # results =[]
     # products = await get_products(db)
     # for product in products:
@@ -60,11 +259,11 @@ async def filter_product_by_dates(from_date:str,to_date:str,db:AsyncSession=Depe
     if from_date > to_date:
         from_date, to_date = to_date, from_date
 
-    query = select(main.Product).where(main.Product.date.between(from_date,to_date))
+    query = curd.products_between_dates_query(from_date,to_date)
     result =await db.execute(query)
-    return result.scalars().all()
-
-from sqlalchemy import select, desc, and_
+    rows = result.all()
+    response = encoded_response(request, rows, list(PRODUCT_COLUMNS))
+    return rows if response is None else response
 
 from pydantic import BaseModel
 
@@ -73,7 +272,7 @@ class ProductNamePrice(BaseModel):
     price: float
     category: str
 @router.get("/filter/price/{max_price}/{min_price}",response_model=List[ProductNamePrice])
-async def product_filter_by_maximum_price(max_price:float,min_price:float,db:AsyncSession=Depends(get_db)):
+async def product_filter_by_maximum_price(request:Request,max_price:float,min_price:float,db:AsyncSession=Depends(get_read_db)):
     # results =[]
     # products = await get_products(db)
     # for product in products:
@@ -83,8 +282,50 @@ async def product_filter_by_maximum_price(max_price:float,min_price:float,db:Asy
     #     return results
     # return "No product found"
 
-    query = (select(main.Product.name, main.Product.price,main.Product.category)
-             .where(and_(main.Product.price <= max_price, main.Product.price >= min_price))
-             .order_by(desc(main.Product.price)))
+    query = curd.products_by_price_query(min_price, max_price)
     result = await db.execute(query)
-    return result.all()
+    rows = result.all()
+    response = encoded_response(request, rows, ["name", "price", "category"])
+    return rows if response is None else response
+
+
+from fastapi.responses import StreamingResponse
+from database import read_session
+import csv
+import io
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+async def stream_products(format:str, conditions:list):
+    # The generator outlives the request handler, so it opens its own session
+    columns = list(PRODUCT_COLUMNS)
+    query = (select(main.Product.__table__).where(*conditions)
+             .order_by(main.Product.date, main.Product.id)
+             .execution_options(yield_per=config.EXPORT_YIELD_PER))
+    async with read_session() as db:
+        result = await db.stream(query)
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            yield buffer.getvalue()
+        async for rows in result.partitions():
+            if format == "csv":
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                yield buffer.getvalue()
+            else:
+                yield "".join(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows)
+
+
+@router.get("/export")
+async def export_products(format:str=Query("ndjson",pattern="^(ndjson|csv)$"),
+                          category:Optional[str]=None,name:Optional[str]=None,
+                          from_date:Optional[date_type]=None,to_date:Optional[date_type]=None,
+                          min_price:Optional[float]=None,max_price:Optional[float]=None):
+    """Stream every matching product as NDJSON or CSV from a server-side cursor, in (date, id) order."""
+    conditions = curd.product_filters(category, name, from_date, to_date, min_price, max_price)
+    headers = {"Content-Disposition": f"attachment; filename=products.{format}"}
+    return StreamingResponse(stream_products(format, conditions), media_type=EXPORT_MEDIA_TYPES[format],
+                             headers=headers)
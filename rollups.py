@@ -0,0 +1,107 @@
+"""Customer rollup tables, kept in step with ecommerse_product by the ingest path.
+
+Each ingest batch turns into per-key deltas (new rows minus the previous version of any
+upserted rows) that are added to the rollups in the same transaction as the batch, so the
+/customer routes read a handful of pre-aggregated rows instead of grouping the fact table.
+"""
+import pandas as pd
+from sqlalchemy import and_, delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from curd import dialect_insert
+from database_models import CustomerLocationMember, CustomerLocationRollup, CustomerNameRollup, Product
+
+ROLLUP_COLUMNS = ["id", "customer_name", "customer_location", "total_sales", "quantity"]
+SUMS = ["order_count", "total_sales", "total_quantity"]
+
+location_rollup = CustomerLocationRollup.__table__
+name_rollup = CustomerNameRollup.__table__
+member = CustomerLocationMember.__table__
+
+
+async def fetch_previous(db: AsyncSession, ids: list) -> pd.DataFrame:
+    """Current values of the rows about to be upserted, so their old contribution can be taken out."""
+    query = select(*[Product.__table__.c[name] for name in ROLLUP_COLUMNS]).where(Product.id.in_(ids))
+    result = await db.execute(query)
+    return pd.DataFrame(result.all(), columns=ROLLUP_COLUMNS)
+
+
+def _deltas(df: pd.DataFrame, previous: pd.DataFrame, keys: list) -> pd.DataFrame:
+    combined = pd.concat([df[ROLLUP_COLUMNS].assign(sign=1), previous.assign(sign=-1)], ignore_index=True)
+    combined = combined.dropna(subset=keys)
+    combined["order_count"] = combined["sign"]
+    combined["total_sales"] = combined["total_sales"].fillna(0).astype("int64") * combined["sign"]
+    combined["total_quantity"] = combined["quantity"].fillna(0).astype("int64") * combined["sign"]
+    grouped = combined.groupby(keys, sort=True)[SUMS].sum().reset_index()
+    return grouped[(grouped[SUMS] != 0).any(axis=1)]
+
+
+async def _add(db: AsyncSession, table, keys: list, deltas: pd.DataFrame, columns: list):
+    if deltas.empty:
+        return
+    conn = await db.connection()
+    stmt = dialect_insert(conn)(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={column: table.c[column] + stmt.excluded[column] for column in columns},
+    )
+    await db.execute(stmt, deltas.to_dict("records"))
+
+
+async def apply_batch(db: AsyncSession, df: pd.DataFrame, previous: pd.DataFrame = None):
+    """Fold an ingest batch into the rollups (call before the batch is committed)."""
+    if previous is None:
+        previous = pd.DataFrame(columns=ROLLUP_COLUMNS)
+
+    by_location = _deltas(df, previous, ["customer_location"])
+    by_name = _deltas(df, previous, ["customer_name"])
+    by_member = _deltas(df, previous, ["customer_location", "customer_name"])
+
+    await _add(db, location_rollup, ["customer_location"], by_location.assign(distinct_customers=0), SUMS)
+    await _add(db, name_rollup, ["customer_name"], by_name.assign(distinct_locations=0), SUMS)
+    await _add(db, member, ["customer_location", "customer_name"], by_member[
+        ["customer_location", "customer_name", "order_count"]], ["order_count"])
+
+    # Distinct counts only change for the keys touched by this batch
+    locations = list(by_member["customer_location"].unique())
+    names = list(by_member["customer_name"].unique())
+    if locations:
+        await db.execute(delete(member).where(and_(member.c.order_count <= 0,
+                                                   member.c.customer_location.in_(locations))))
+        customers = (select(func.count()).where(member.c.customer_location == location_rollup.c.customer_location)
+                     .correlate(location_rollup).scalar_subquery())
+        await db.execute(update(location_rollup).where(location_rollup.c.customer_location.in_(locations))
+                         .values(distinct_customers=customers))
+    if names:
+        places = (select(func.count()).where(member.c.customer_name == name_rollup.c.customer_name)
+                  .correlate(name_rollup).scalar_subquery())
+        await db.execute(update(name_rollup).where(name_rollup.c.customer_name.in_(names))
+                         .values(distinct_locations=places))
+
+    await db.execute(delete(location_rollup).where(location_rollup.c.order_count <= 0))
+    await db.execute(delete(name_rollup).where(name_rollup.c.order_count <= 0))
+
+
+def rebuild(conn):
+    """Recompute every rollup from ecommerse_product (sync Connection, e.g. from a migration)."""
+    for table in (member, location_rollup, name_rollup):
+        conn.execute(delete(table))
+    conn.execute(insert(member).from_select(
+        ["customer_location", "customer_name", "order_count"],
+        select(Product.customer_location, Product.customer_name, func.count())
+        .where(and_(Product.customer_location.isnot(None), Product.customer_name.isnot(None)))
+        .group_by(Product.customer_location, Product.customer_name)))
+    conn.execute(insert(location_rollup).from_select(
+        ["customer_location", *SUMS, "distinct_customers"],
+        select(Product.customer_location, func.count(),
+               func.coalesce(func.sum(Product.total_sales), 0), func.coalesce(func.sum(Product.quantity), 0),
+               func.count(func.distinct(Product.customer_name)))
+        .where(Product.customer_location.isnot(None))
+        .group_by(Product.customer_location)))
+    conn.execute(insert(name_rollup).from_select(
+        ["customer_name", *SUMS, "distinct_locations"],
+        select(Product.customer_name, func.count(),
+               func.coalesce(func.sum(Product.total_sales), 0), func.coalesce(func.sum(Product.quantity), 0),
+               func.count(func.distinct(Product.customer_location)))
+        .where(Product.customer_name.isnot(None))
+        .group_by(Product.customer_name)))
@@ -0,0 +1,170 @@
+import asyncio
+import heapq
+import logging
+from array import array
+from itertools import groupby
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+
+import config
+from database_models import Product
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("name", "category")
+
+# Rough cost of a row's id, dict entry and list slots, and of a distinct text's bookkeeping
+ROW_OVERHEAD_BYTES = 120
+TEXT_OVERHEAD_BYTES = 100
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """In-memory inverted index of Product.name / Product.category trigrams.
+
+    Postings are kept per distinct (lowercased) text rather than per row, since names and
+    categories repeat heavily: each trigram maps to an array('I') of text numbers, and each
+    text to an array('I') of the row ordinals carrying it. Both are appended in ascending
+    order, so a keyword is answered by intersecting its trigrams' postings, checking the few
+    candidate texts with a substring test and merging their row lists lazily (in product id
+    order, kept per text and re-sorted only after the text gains rows).
+    """
+
+    def __init__(self, memory_budget: int):
+        self.memory_budget = memory_budget
+        self.ready = False
+        self.over_budget = False
+        self.reset()
+
+    def reset(self):
+        self.ids: List[str] = []
+        self.ordinals: Dict[str, int] = {}
+        self.dead = set()
+        self.text_numbers: Dict[str, Dict[str, int]] = {field: {} for field in FIELDS}
+        self.texts: Dict[str, List[str]] = {field: [] for field in FIELDS}
+        self.rows: Dict[str, List[array]] = {field: [] for field in FIELDS}
+        self.row_texts: Dict[str, array] = {field: array("I") for field in FIELDS}
+        # (field, text number) -> that text's row ordinals sorted by product id; dropped when rows are added
+        self.by_id: Dict[tuple, List[int]] = {}
+        self.postings: Dict[str, Dict[str, array]] = {field: {} for field in FIELDS}
+        self.bytes_used = 0
+
+    @property
+    def usable(self) -> bool:
+        return self.ready and not self.over_budget
+
+    def _text_number(self, field: str, text: str) -> int:
+        number = self.text_numbers[field].get(text)
+        if number is None:
+            number = self.text_numbers[field][text] = len(self.texts[field])
+            self.texts[field].append(text)
+            self.rows[field].append(array("I"))
+            postings = self.postings[field]
+            grams = trigrams(text)
+            for gram in grams:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array("I")
+                posting.append(number)
+            self.bytes_used += TEXT_OVERHEAD_BYTES + len(text) + 4 * len(grams)
+        return number
+
+    def add(self, product_id: str, name: Optional[str], category: Optional[str]):
+        if self.over_budget:
+            return
+        values = {"name": (name or "").lower(), "category": (category or "").lower()}
+        previous = self.ordinals.get(product_id)
+        if previous is not None:
+            if all(self.texts[field][self.row_texts[field][previous]] == values[field] for field in FIELDS):
+                return
+            # Changed row: retire the old ordinal instead of rewriting row lists
+            self.dead.add(previous)
+
+        ordinal = len(self.ids)
+        self.ids.append(product_id)
+        self.ordinals[product_id] = ordinal
+        self.bytes_used += ROW_OVERHEAD_BYTES + len(product_id)
+        for field in FIELDS:
+            number = self._text_number(field, values[field])
+            self.rows[field][number].append(ordinal)
+            self.row_texts[field].append(number)
+            self.by_id.pop((field, number), None)
+
+        if self.bytes_used > self.memory_budget:
+            logger.warning("Search index exceeded its %d byte budget; falling back to SQL", self.memory_budget)
+            self.over_budget = True
+            self.reset()
+
+    def add_rows(self, rows):
+        for product_id, name, category in rows:
+            self.add(product_id, name, category)
+
+    def search(self, field: str, keyword: str, limit: int, offset: int = 0) -> Optional[List[str]]:
+        """Ids of matching products, or None if the index can't answer (not built, over budget, < 3 chars).
+
+        Ranked like the SQLite query in curd.search_products_query: earliest match position, then
+        shortest text, then product id, so pages match whether or not the index is on. On
+        PostgreSQL the SQL path ranks by pg_trgm similarity instead, so the order differs there.
+        """
+        keyword = keyword.lower()
+        grams = trigrams(keyword)
+        if not self.usable or not grams:
+            return None
+        postings = self.postings[field]
+        lists = sorted((postings.get(gram, ()) for gram in grams), key=len)
+        if not lists[0]:
+            return []
+        texts = self.texts[field]
+        matched = [number for number in set(lists[0]).intersection(*lists[1:]) if keyword in texts[number]]
+
+        def rank(number):
+            return texts[number].find(keyword), len(texts[number])
+
+        wanted = offset + limit
+        found = []
+        ids = self.ids
+        for _, tied in groupby(sorted(matched, key=rank), key=rank):
+            for ordinal in heapq.merge(*(self._by_id(field, number) for number in tied), key=ids.__getitem__):
+                if ordinal in self.dead:
+                    continue
+                found.append(ordinal)
+                if len(found) >= wanted:
+                    return [ids[ordinal] for ordinal in found[offset:]]
+        return [ids[ordinal] for ordinal in found[offset:]]
+
+    def _by_id(self, field: str, number: int) -> List[int]:
+        ordered = self.by_id.get((field, number))
+        if ordered is None:
+            ordered = self.by_id[(field, number)] = sorted(self.rows[field][number], key=self.ids.__getitem__)
+        return ordered
+
+
+index = TrigramIndex(config.SEARCH_INDEX_MEMORY_MB * 1024 * 1024)
+
+
+async def build(session_factory, batch_size: int = 10000):
+    """Load every product's id, name and category from ecommerse_product into the index."""
+    index.reset()
+    index.ready = False
+    index.over_budget = False
+    query = select(Product.id, Product.name, Product.category).execution_options(yield_per=batch_size)
+    async with session_factory() as db:
+        result = await db.stream(query)
+        async for rows in result.partitions():
+            index.add_rows(rows)
+            if index.over_budget:
+                return
+            # Yield to the event loop between partitions so requests keep being served
+            await asyncio.sleep(0)
+    index.ready = True
+    logger.info("Search index built: %d rows, ~%d bytes", len(index.ids), index.bytes_used)
+
+
+def add_frame(df):
+    """Add rows of a freshly committed ingest batch."""
+    if config.SEARCH_INDEX_ENABLED and not index.over_budget:
+        index.add_rows(zip(df["id"], df["name"], df["category"]))
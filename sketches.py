@@ -0,0 +1,359 @@
+"""Probabilistic sketches of the customer columns, maintained by ingest (SKETCHES_ENABLED=true).
+
+- HyperLogLog of distinct customer names: overall, per customer_location and per category.
+  Relative standard error 1.04 / sqrt(2 ** SKETCH_HLL_PRECISION) (0.81% at precision 14).
+- Count-Min sketch of orders per customer, with a top-K table of the heaviest customers.
+  Estimates never undercount and overcount by at most e / SKETCH_CM_WIDTH of all orders with
+  probability 1 - exp(-SKETCH_CM_DEPTH).
+
+Each HyperLogLog and the top-K table is one row of `analytics_sketch`. An ingest batch locks
+and updates the rows it touches in the batch's transaction, so readers fetch a few kilobytes
+instead of scanning the fact table. The Count-Min counters are rows of `analytics_count_min`,
+which a batch increments in place (INSERT ... ON CONFLICT DO UPDATE) for the counters its
+customers hash to, rather than rewriting the whole sketch. The top-K row carries the sketch's
+shape and total, so the error bound is read without the counters. Distinct counts are
+insert-only: a customer whose orders are all replaced by upserts is still counted until the
+next rebuild.
+
+    python sketches.py rebuild     # recompute every sketch from ecommerse_product
+"""
+import asyncio
+import heapq
+import json
+import math
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import delete, select
+
+import config
+from curd import dialect_insert
+from database import engine
+from database_models import AnalyticsSketch, CountMinCell, Product
+
+sketch_table = AnalyticsSketch.__table__
+count_min_table = CountMinCell.__table__
+
+CUSTOMERS = "customers"
+BY_LOCATION = "customers:location:"
+BY_CATEGORY = "customers:category:"
+TOP_CUSTOMERS = "orders_by_customer:top"
+
+SPLITS = {"location": ("customer_location", BY_LOCATION), "category": ("category", BY_CATEGORY)}
+
+# Rows read per round trip by rebuild()
+REBUILD_CHUNK_ROWS = 50_000
+
+
+def hash_values(values) -> np.ndarray:
+    # pandas' SipHash with its fixed key: 64-bit and stable across processes
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    lengths = np.zeros(len(values), dtype=np.uint8)
+    remaining = values.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        large = remaining >= np.uint64(1 << shift)
+        lengths[large] += shift
+        remaining[large] >>= np.uint64(shift)
+    return lengths + (remaining > 0)
+
+
+class HyperLogLog:
+    def __init__(self, precision: int = None, registers: np.ndarray = None):
+        self.precision = precision or config.SKETCH_HLL_PRECISION
+        self.registers = registers if registers is not None else np.zeros(1 << self.precision, dtype=np.uint8)
+
+    @property
+    def standard_error(self) -> float:
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add_hashes(self, hashes: np.ndarray):
+        if not len(hashes):
+            return
+        suffix_bits = 64 - self.precision
+        index = (hashes >> np.uint64(suffix_bits)).astype(np.int64)
+        rank = (suffix_bits + 1 - _bit_length(hashes & np.uint64((1 << suffix_bits) - 1))).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def estimate(self) -> float:
+        m = len(self.registers)
+        raw = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)  # linear counting for small cardinalities
+        return float(raw)
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + self.registers.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        return cls(data[0], np.frombuffer(data, dtype=np.uint8, offset=1).copy())
+
+
+def count_min_buckets(hashes: np.ndarray, width: int, depth: int) -> np.ndarray:
+    # Row i hashes to h1 + i * h2 (Kirsch-Mitzenmacher double hashing of one 64-bit hash)
+    low = (hashes & np.uint64(0xFFFFFFFF)).astype(np.int64)
+    high = (hashes >> np.uint64(32)).astype(np.int64) | 1
+    rows = np.arange(depth, dtype=np.int64)[:, None]
+    return (low[None, :] + rows * high[None, :]) % width
+
+
+class CountMinSketch:
+    """In-memory counters, used by rebuild(); ingest updates the stored counters directly."""
+
+    def __init__(self, width: int = None, depth: int = None):
+        self.width = width or config.SKETCH_CM_WIDTH
+        self.depth = depth or config.SKETCH_CM_DEPTH
+        self.counts = np.zeros((self.depth, self.width), dtype=np.int64)
+
+    def add_hashes(self, hashes: np.ndarray, counts: np.ndarray):
+        buckets = count_min_buckets(hashes, self.width, self.depth)
+        for row in range(self.depth):
+            np.add.at(self.counts[row], buckets[row], counts)
+
+    def query_hashes(self, hashes: np.ndarray) -> np.ndarray:
+        buckets = count_min_buckets(hashes, self.width, self.depth)
+        return self.counts[np.arange(self.depth)[:, None], buckets].min(axis=0)
+
+    def cells(self) -> List[dict]:
+        rows, buckets = np.nonzero(self.counts)
+        return [{"hash_row": int(row), "bucket": int(bucket), "count": int(self.counts[row, bucket])}
+                for row, bucket in zip(rows, buckets)]
+
+
+class TopK:
+    """The `capacity` customers with the highest Count-Min estimates seen so far.
+
+    Also holds the Count-Min sketch's width, depth and total orders, which give its error bound.
+    """
+
+    def __init__(self, capacity: int = None, counts: Dict[str, int] = None, width: int = None,
+                 depth: int = None, total: int = 0):
+        self.capacity = capacity or config.SKETCH_TOP_K
+        self.counts = counts or {}
+        self.width = width or config.SKETCH_CM_WIDTH
+        self.depth = depth or config.SKETCH_CM_DEPTH
+        self.total = total
+
+    @property
+    def confidence(self) -> float:
+        return 1 - math.exp(-self.depth)
+
+    def error_bound(self) -> int:
+        return math.ceil(math.e / self.width * self.total)
+
+    def update(self, names: Iterable[str], estimates: Iterable[int]):
+        for name, estimate in zip(names, estimates):
+            self.counts[name] = int(estimate)
+        if len(self.counts) > self.capacity:
+            self.counts = dict(heapq.nlargest(self.capacity, self.counts.items(), key=lambda item: item[1]))
+
+    def top(self, limit: int) -> list:
+        return heapq.nlargest(limit, self.counts.items(), key=lambda item: item[1])
+
+    def to_bytes(self) -> bytes:
+        return json.dumps({"capacity": self.capacity, "counts": self.counts, "width": self.width,
+                           "depth": self.depth, "total": self.total}).encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TopK":
+        state = json.loads(data)
+        return cls(state["capacity"], state["counts"], state["width"], state["depth"], state["total"])
+
+
+KINDS = {CUSTOMERS: HyperLogLog, BY_LOCATION: HyperLogLog, BY_CATEGORY: HyperLogLog, TOP_CUSTOMERS: TopK}
+
+
+def _kind(name: str):
+    return KINDS[name] if name in KINDS else KINDS[name[:name.rindex(":") + 1]]
+
+
+class Sketches:
+    """The sketches touched by one ingest batch (or a rebuild), loaded from and written back to the table."""
+
+    def __init__(self, stored: Dict[str, bytes] = None):
+        # Empty data: a row created by this batch's apply_batch, not yet written
+        self.sketches = {name: _kind(name).from_bytes(data) if data else _kind(name)()
+                         for name, data in (stored or {}).items()}
+
+    def get(self, name: str):
+        if name not in self.sketches:
+            self.sketches[name] = _kind(name)()
+        return self.sketches[name]
+
+    @staticmethod
+    def split_names(df: pd.DataFrame) -> List[str]:
+        names = []
+        for column, prefix in SPLITS.values():
+            names += [prefix + str(value) for value in df[column].dropna().unique()]
+        return names
+
+    def add(self, df: pd.DataFrame, previous: Optional[pd.DataFrame] = None) -> pd.Series:
+        """Fold new rows into the distinct counts and return the change in orders per customer.
+
+        `previous` holds the old version of upserted rows (their orders are taken out).
+        """
+        df = df[df["customer_name"].notna()]
+        hashes = hash_values(df["customer_name"])
+        self.get(CUSTOMERS).add_hashes(hashes)
+        for column, prefix in SPLITS.values():
+            values = df[column]
+            for value in values.dropna().unique():
+                self.get(prefix + str(value)).add_hashes(hashes[(values == value).to_numpy()])
+
+        orders = df["customer_name"].value_counts()
+        if previous is not None and not previous.empty:
+            orders = orders.sub(previous["customer_name"].dropna().value_counts(), fill_value=0)
+            orders = orders[orders != 0]
+        return orders
+
+    def rows(self) -> List[dict]:
+        now = datetime.now()
+        return [{"name": name, "data": sketch.to_bytes(), "updated_at": now} for name, sketch in self.sketches.items()]
+
+
+def _upsert(conn):
+    stmt = dialect_insert(conn)(sketch_table)
+    return stmt.on_conflict_do_update(index_elements=["name"],
+                                      set_={"data": stmt.excluded.data, "updated_at": stmt.excluded.updated_at})
+
+
+def _increment(conn):
+    stmt = dialect_insert(conn)(count_min_table)
+    stmt = stmt.on_conflict_do_update(index_elements=["hash_row", "bucket"],
+                                      set_={"count": count_min_table.c["count"] + stmt.excluded["count"]})
+    return stmt.returning(count_min_table.c.hash_row, count_min_table.c.bucket, count_min_table.c["count"])
+
+
+async def _count_orders(db, top: TopK, orders: pd.Series):
+    """Add a batch's orders per customer to the stored counters and refresh the top-K from them."""
+    name_hashes = hash_values(orders.index)
+    values = orders.to_numpy(dtype=np.int64)
+    buckets = count_min_buckets(name_hashes, top.width, top.depth)
+    keys = pd.MultiIndex.from_arrays([np.repeat(np.arange(top.depth), len(values)), buckets.ravel()])
+    # One increment per counter, in key order so concurrent upserts lock counters in the same order
+    increments = pd.Series(np.tile(values, top.depth), index=keys).groupby(level=[0, 1]).sum()
+    result = await db.execute(_increment(await db.connection()),
+                              [{"hash_row": int(row), "bucket": int(bucket), "count": int(count)}
+                               for (row, bucket), count in increments.items()])
+    stored = pd.Series({(row, bucket): count for row, bucket, count in result})
+    estimates = stored.reindex(keys).to_numpy().reshape(top.depth, len(values)).min(axis=0)
+    top.total += int(values.sum())
+    top.update(orders.index, estimates)
+
+
+async def apply_batch(db, df: pd.DataFrame, previous: Optional[pd.DataFrame] = None):
+    """Fold an ingest batch into the stored sketches (call before the batch is committed)."""
+    if not config.SKETCHES_ENABLED:
+        return
+    # Locking the overall rows first serializes concurrent ingest jobs' read-modify-write of the sketches
+    result = await db.execute(select(sketch_table.c.name, sketch_table.c.data)
+                              .where(sketch_table.c.name.in_([CUSTOMERS, TOP_CUSTOMERS])).with_for_update())
+    stored = dict(result.all())
+    if CUSTOMERS not in stored:
+        return  # enabled on an existing database but never built: partial sketches would undercount
+    names = Sketches.split_names(df)
+    if names:
+        # A location or category first seen in this batch gets its row now, so it is locked like the rest
+        stmt = dialect_insert(await db.connection())(sketch_table).on_conflict_do_nothing(index_elements=["name"])
+        await db.execute(stmt, [{"name": name, "data": b"", "updated_at": datetime.now()} for name in names])
+        result = await db.execute(select(sketch_table.c.name, sketch_table.c.data)
+                                  .where(sketch_table.c.name.in_(names)).with_for_update())
+        stored.update(result.all())
+    sketches = Sketches(stored)
+    orders = sketches.add(df, previous)
+    if not orders.empty:
+        await _count_orders(db, sketches.get(TOP_CUSTOMERS), orders)
+    await db.execute(_upsert(await db.connection()), sketches.rows())
+
+
+def rebuild(conn):
+    """Recompute every sketch from ecommerse_product (sync Connection, e.g. from a migration)."""
+    conn.execute(delete(sketch_table))
+    conn.execute(delete(count_min_table))
+    sketches = Sketches()
+    top = sketches.get(TOP_CUSTOMERS)
+    counts = CountMinSketch(top.width, top.depth)
+    columns = ["customer_name", "customer_location", "category"]
+    result = conn.execution_options(stream_results=True, yield_per=REBUILD_CHUNK_ROWS).execute(
+        select(*[Product.__table__.c[name] for name in columns]))
+    for rows in result.partitions():
+        orders = sketches.add(pd.DataFrame(rows, columns=columns))
+        if orders.empty:
+            continue
+        name_hashes = hash_values(orders.index)
+        values = orders.to_numpy(dtype=np.int64)
+        counts.add_hashes(name_hashes, values)
+        top.total += int(values.sum())
+        top.update(orders.index, counts.query_hashes(name_hashes))
+    # Stored even when the table is empty, so readers can tell "no customers" from "never built"
+    sketches.get(CUSTOMERS)
+    conn.execute(sketch_table.insert(), sketches.rows())
+    cells = counts.cells()
+    if cells:
+        conn.execute(count_min_table.insert(), cells)
+
+
+async def load(db, names: List[str] = None, prefix: str = None) -> Sketches:
+    query = select(sketch_table.c.name, sketch_table.c.data)
+    if names is not None:
+        query = query.where(sketch_table.c.name.in_(names))
+    if prefix is not None:
+        query = query.where(sketch_table.c.name.startswith(prefix))
+    result = await db.execute(query)
+    return Sketches(dict(result.all()))
+
+
+def cardinality(key: Optional[str], sketch: HyperLogLog) -> dict:
+    """Distinct-count estimate with its ~95% (two standard errors) bound."""
+    estimate = sketch.estimate()
+    return {"key": key, "unique_customers": int(round(estimate)),
+            "error_bound": int(math.ceil(2 * sketch.standard_error * estimate)), "confidence": 0.95}
+
+
+async def unique_customers(db, by: Optional[str] = None) -> Optional[list]:
+    """Estimated distinct customers overall or per location / category; None if nothing is stored."""
+    if by is None:
+        sketches = await load(db, names=[CUSTOMERS])
+        sketch = sketches.sketches.get(CUSTOMERS)
+        return None if sketch is None else [cardinality(None, sketch)]
+    prefix = SPLITS[by][1]
+    sketches = await load(db, prefix=prefix)
+    if not sketches.sketches:
+        return None
+    estimates = [cardinality(name[len(prefix):], sketch) for name, sketch in sketches.sketches.items()]
+    return sorted(estimates, key=lambda row: row["unique_customers"], reverse=True)
+
+
+async def heavy_hitters(db, limit: int) -> Optional[list]:
+    """Customers with the most orders by Count-Min estimate, with the one-sided error bound."""
+    sketches = await load(db, names=[TOP_CUSTOMERS])
+    top = sketches.sketches.get(TOP_CUSTOMERS)
+    if top is None:
+        return None
+    bound = top.error_bound()
+    return [{"customer_name": name, "no_of_orders": estimate, "error_bound": bound,
+             "confidence": round(top.confidence, 4)} for name, estimate in top.top(limit)]
+
+
+async def _main(command: str) -> int:
+    try:
+        if command != "rebuild":
+            print(__doc__)
+            return 2
+        async with engine.begin() as conn:
+            await conn.run_sync(rebuild)
+        print("sketches rebuilt")
+        return 0
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "")))
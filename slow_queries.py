@@ -0,0 +1,209 @@
+"""Slow-query log: statements slower than SLOW_QUERY_MS, with their parameters and query plan.
+
+The metrics cursor hooks time each statement once and pass the timing on through
+metrics.statement_listeners. A statement over the threshold is logged, and the
+SLOW_QUERY_LOG_SIZE worst statements are kept (one entry per SQL text, holding its worst
+execution) for GET /debug/slow-queries. For a sampled fraction of slow SELECTs
+(SLOW_QUERY_EXPLAIN_RATE) a background task re-runs the statement on its own connection under
+EXPLAIN (ANALYZE, BUFFERS) — EXPLAIN QUERY PLAN on SQLite — so the plan is stored next to the
+timing. Only SELECTs are explained, since ANALYZE executes the statement, and not locking ones
+(FOR UPDATE / FOR SHARE), which would wait on the row locks the caller's transaction holds.
+A statement that already has a plan is explained again only when it sets a new worst time or
+its plan is older than SLOW_QUERY_PLAN_TTL_SECONDS, so a slow database isn't loaded with
+repeat EXPLAINs.
+"""
+import asyncio
+import logging
+import random
+import re
+from datetime import datetime
+from typing import Dict, Optional
+
+from fastapi import APIRouter
+
+import config
+import database
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Longest parameter repr kept per value, so a bulk insert doesn't pin megabytes
+MAX_PARAMETER_CHARS = 200
+
+
+class SlowQuery:
+    __slots__ = ("statement", "count", "worst_ms", "last_ms", "last_seen", "parameters", "path", "engine",
+                 "plan", "plan_ms", "plan_at")
+
+    def __init__(self, statement: str, engine: str):
+        self.statement = statement
+        self.engine = engine
+        self.count = 0
+        self.worst_ms = 0.0
+        self.last_ms = 0.0
+        self.last_seen = None
+        self.parameters = None
+        self.path = None
+        self.plan = None
+        self.plan_ms = None
+        self.plan_at = None
+
+    def as_dict(self) -> dict:
+        return {
+            "statement": self.statement,
+            "engine": self.engine,
+            "count": self.count,
+            "worst_ms": round(self.worst_ms, 3),
+            "last_ms": round(self.last_ms, 3),
+            "last_seen": self.last_seen.isoformat() if self.last_seen else None,
+            "parameters": self.parameters,
+            "path": self.path,
+            "plan": self.plan,
+            "plan_ms": self.plan_ms,
+            "plan_at": self.plan_at.isoformat() if self.plan_at else None,
+        }
+
+
+class SlowQueryLog:
+    def __init__(self, size: int):
+        self.size = size
+        self.entries: Dict[str, SlowQuery] = {}
+        self.recorded = 0
+        self.explaining = set()
+        self._tasks = set()
+
+    def record(self, engine: str, statement: str, parameters, elapsed_ms: float, path: Optional[str]):
+        """Count a slow execution; returns the entry and whether this run is its new worst."""
+        self.recorded += 1
+        entry = self.entries.get(statement)
+        if entry is None:
+            entry = self.entries[statement] = SlowQuery(statement, engine)
+            if len(self.entries) > self.size:
+                # Keep the worst N: evict the least bad statement (possibly the new one)
+                del self.entries[min(self.entries.values(), key=lambda item: item.worst_ms).statement]
+        entry.count += 1
+        entry.last_ms = elapsed_ms
+        entry.last_seen = datetime.now()
+        worst = elapsed_ms > entry.worst_ms
+        if worst:
+            entry.worst_ms = elapsed_ms
+            entry.parameters = _format_parameters(parameters)
+            entry.path = path
+        return entry, worst
+
+    @staticmethod
+    def wants_plan(entry: SlowQuery, worst: bool) -> bool:
+        if entry.plan_at is None or worst:
+            return True
+        return (datetime.now() - entry.plan_at).total_seconds() >= config.SLOW_QUERY_PLAN_TTL_SECONDS
+
+    def worst(self, limit: Optional[int] = None) -> list:
+        ordered = sorted(self.entries.values(), key=lambda item: item.worst_ms, reverse=True)
+        return [entry.as_dict() for entry in ordered[:limit]]
+
+    def clear(self):
+        self.entries.clear()
+        self.recorded = 0
+
+    def explain_later(self, engine, entry: SlowQuery, statement: str, parameters):
+        if statement in self.explaining:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # executed outside the event loop (sync engine use); no plan
+        self.explaining.add(statement)
+        task = loop.create_task(self._explain(engine, entry, statement, parameters))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _explain(self, engine, entry: SlowQuery, statement: str, parameters):
+        try:
+            async with engine.connect() as conn:
+                if conn.dialect.name == "postgresql":
+                    result = await conn.exec_driver_sql("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+                    plan = [row[0] for row in result]
+                else:
+                    result = await conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+                    plan = [row[-1] for row in result]
+                await conn.rollback()
+            entry.plan = "\n".join(plan)
+            entry.plan_ms = entry.last_ms
+            entry.plan_at = datetime.now()
+        except Exception as exc:
+            logger.warning("EXPLAIN of slow query failed: %s", exc)
+        finally:
+            self.explaining.discard(statement)
+
+
+def _format_parameters(parameters):
+    if parameters is None:
+        return None
+    if isinstance(parameters, dict):
+        return {key: _format_value(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_format_value(value) for value in parameters]
+    return _format_value(parameters)
+
+
+def _format_value(value):
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = value if isinstance(value, str) else repr(value)
+    return text if len(text) <= MAX_PARAMETER_CHARS else text[:MAX_PARAMETER_CHARS] + "..."
+
+
+# Row locks: re-running the statement on a second connection would wait on the caller's transaction
+_LOCKING_CLAUSE = re.compile(r"\bFOR\s+(?:NO\s+KEY\s+)?UPDATE\b|\bFOR\s+(?:KEY\s+)?SHARE\b", re.IGNORECASE)
+
+
+def _is_select(statement: str) -> bool:
+    return statement.lstrip().upper().startswith("SELECT") and not _LOCKING_CLAUSE.search(statement)
+
+
+log = SlowQueryLog(config.SLOW_QUERY_LOG_SIZE)
+
+
+# Sync engine (what the statement hook sees) -> (name, async engine used to re-run it under EXPLAIN)
+_engines = {engine.sync_engine: (name, engine) for name, engine in database.engines.items()}
+
+
+def _on_statement(conn, statement, parameters, executemany, elapsed):
+    # Fed by the metrics cursor hook, which times every statement once for both consumers
+    elapsed_ms = elapsed * 1000
+    if config.SLOW_QUERY_MS <= 0 or elapsed_ms < config.SLOW_QUERY_MS or statement.startswith("EXPLAIN"):
+        return
+    target = _engines.get(conn.engine)
+    if target is None:
+        return
+    name, engine = target
+    stats = metrics.current.get()
+    entry, worst = log.record(name, statement, None if executemany else parameters, elapsed_ms,
+                              stats.path if stats else None)
+    logger.warning("Slow query (%.1f ms) on %s: %s", elapsed_ms, name, " ".join(statement.split())[:500])
+    if (not executemany and _is_select(statement) and log.wants_plan(entry, worst)
+            and random.random() < config.SLOW_QUERY_EXPLAIN_RATE):
+        log.explain_later(engine, entry, statement, parameters)
+
+
+metrics.statement_listeners.append(_on_statement)
+
+
+router = APIRouter(prefix="/debug", tags=["Debug"])
+
+
+@router.get("/slow-queries")
+async def slow_queries(limit: Optional[int] = None):
+    """The worst statements over SLOW_QUERY_MS, slowest first, with parameters and the captured plan."""
+    return {
+        "threshold_ms": config.SLOW_QUERY_MS,
+        "explain_rate": config.SLOW_QUERY_EXPLAIN_RATE,
+        "recorded": log.recorded,
+        "queries": log.worst(limit),
+    }
+
+
+@router.delete("/slow-queries")
+async def clear_slow_queries():
+    log.clear()
+    return {"cleared": True}
@@ -0,0 +1,67 @@
+"""The in-memory trigram index must page through results exactly like the SQL search it replaces."""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import curd
+import search_index
+from database_models import Product
+
+# Many rows share a text (same match position and length), and ids are loaded out of order, so
+# the order within a tie is decided by the id tie-break alone
+ROWS = [
+    ("ORD09", "Laptop", "Electronics"),
+    ("ORD03", "Laptop", "Electronics"),
+    ("ORD11", "Laptop Stand", "Accessories"),
+    ("ORD01", "Gaming Laptop", "Electronics"),
+    ("ORD07", "laptop", "ELECTRONICS"),
+    ("ORD05", "Laptop", "Home Electronics"),
+    ("ORD02", "Clap Lamp", "Home Appliances"),
+    ("ORD10", "Laptop Bag", "Accessories"),
+    ("ORD04", "Laptop", "Electronics"),
+    ("ORD08", "Slap Bracelet", "Accessories"),
+    ("ORD06", "Gaming Laptop", "Electronics"),
+]
+
+
+async def _search_both(field, keyword, limit, offset):
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Product.__table__.create)
+        await conn.execute(insert(Product), [{"id": i, "name": n, "category": c} for i, n, c in ROWS])
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    index = search_index.index
+    await search_index.build(sessions)
+    try:
+        from_index = index.search(field, keyword, limit, offset)
+        async with sessions() as db:
+            rows = await curd.search_products(db, Product.__table__.c[field], keyword, limit, offset)
+        return from_index, [row.id for row in rows]
+    finally:
+        index.reset()
+        index.ready = False
+        await engine.dispose()
+
+
+@pytest.mark.parametrize("field,keyword", [("name", "lap"), ("name", "LAPTOP"), ("category", "ELEC"),
+                                           ("category", "access")])
+@pytest.mark.parametrize("limit,offset", [(100, 0), (2, 0), (2, 1), (3, 4)])
+def test_index_pages_match_sql(field, keyword, limit, offset):
+    from_index, from_sql = asyncio.run(_search_both(field, keyword, limit, offset))
+    assert from_index == from_sql
+
+
+def test_changed_row_keeps_id_order():
+    index = search_index.TrigramIndex(1 << 20)
+    index.add_rows([("B", "Laptop", ""), ("C", "Laptop", ""), ("A", "Desk", "")])
+    index.add("A", "Laptop", "")
+    index.ready = True
+    assert index.search("name", "laptop", 10) == ["A", "B", "C"]